@@ -0,0 +1,108 @@
+"""
+Compare src.htmlparse with the BeautifulSoup extraction it replaced on saved
+admin pages. Run from the repository root:
+
+    uv run python -m benchmarks.html_parsing [--number N]
+"""
+
+import argparse
+import re
+import timeit
+from pathlib import Path
+
+from bs4 import BeautifulSoup
+
+from src import htmlparse
+
+FIXTURES_DIR = Path(__file__).parent / "fixtures"
+LOGIN_URL_PATTERN = r'https://admin\.digikala\.com/login/[^"]+'
+
+
+def soup_table_rows(html: str, name_column: int) -> dict[str, list[str]]:
+    soup = BeautifulSoup(html, "html.parser")
+    table_form = soup.find(id="tableForm")
+    if not table_form:
+        return {}
+
+    table = table_form.find("table")
+    if not table:
+        return {}
+
+    rows: dict[str, list[str]] = {}
+    for row in table.find_all("tr"):
+        cells = [cell.text.strip() for cell in row.find_all("td")]
+        if len(cells) <= name_column:
+            continue
+        rows.setdefault(cells[name_column], cells)
+    return rows
+
+
+def soup_first_link_href(html: str) -> str | None:
+    return BeautifulSoup(html, "html.parser").find("a")["href"]
+
+
+def soup_input_value(html: str, name: str) -> str | None:
+    field = BeautifulSoup(html, "html.parser").find("input", {"name": name})
+    return field["value"] if field else None
+
+
+def soup_script_redirect_url(html: str, url_pattern: str) -> str | None:
+    for script in BeautifulSoup(html, "html.parser").find_all("script"):
+        if "window.location.href" in script.text:
+            match = re.search(url_pattern, script.text)
+            return match.group(0) if match else None
+    return None
+
+
+CASES = [
+    (
+        "zip_table.html",
+        lambda html: soup_table_rows(html, 0),
+        lambda html: htmlparse.table_rows(html, 0),
+    ),
+    (
+        "excel_table.html",
+        lambda html: soup_table_rows(html, 2),
+        lambda html: htmlparse.table_rows(html, 2),
+    ),
+    ("export_redirect.html", soup_first_link_href, htmlparse.first_link_href),
+    (
+        "exported_item.html",
+        lambda html: soup_input_value(html, "exported_file"),
+        lambda html: htmlparse.input_value(html, "exported_file"),
+    ),
+    (
+        "login_redirect.html",
+        lambda html: soup_script_redirect_url(html, LOGIN_URL_PATTERN),
+        lambda html: htmlparse.script_redirect_url(html, LOGIN_URL_PATTERN),
+    ),
+]
+
+
+def best_of(func, html: str, number: int) -> float:
+    """Best per-call time over 5 repeats of `number` calls, in milliseconds."""
+    times = timeit.repeat(lambda: func(html), number=number, repeat=5)
+    return min(times) / number * 1000
+
+
+def main(number: int):
+    print(f"{'fixture':<24}{'KiB':>6}{'soup ms':>10}{'fast ms':>10}{'speedup':>9}")
+    for fixture, soup_func, fast_func in CASES:
+        html = (FIXTURES_DIR / fixture).read_text(encoding="utf-8")
+        expected = soup_func(html)
+        assert expected, f"{fixture}: nothing extracted"
+        assert fast_func(html) == expected, f"{fixture}: results differ"
+
+        soup_ms = best_of(soup_func, html, number)
+        fast_ms = best_of(fast_func, html, number)
+        print(
+            f"{fixture:<24}{len(html) / 1024:>6.0f}{soup_ms:>10.3f}"
+            f"{fast_ms:>10.3f}{soup_ms / fast_ms:>8.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark admin page parsing")
+    parser.add_argument("--number", type=int, default=20, help="calls per repeat")
+    args = parser.parse_args()
+    main(args.number)
@@ -1,34 +1,134 @@
+import atexit
 import logging
 import logging.config
+import os
 import tomllib
 from pathlib import Path
 
 import dotenv
 
+from . import logcontext
+
 dotenv.load_dotenv()
 
 base_dir = Path(__file__).parent.parent
 
 with open(base_dir / "config.toml", "rb") as f:
-    content_config: dict[str, str] = tomllib.load(f).get("content", {})
+    toml_config: dict[str, dict] = tomllib.load(f)
+
+content_config: dict[str, str] = toml_config.get("content", {})
+processing_config: dict[str, int] = toml_config.get("processing", {})
+http_config: dict[str, float] = toml_config.get("http", {})
+upload_config: dict[str, int] = toml_config.get("upload", {})
+polling_config: dict[str, float] = toml_config.get("polling", {})
+retry_config: dict = toml_config.get("retry", {})
+ratelimit_config: dict[str, float] = toml_config.get("ratelimit", {})
+logging_config: dict = toml_config.get("logging", {})
 
 content_dir = Path(content_config.get("content_dir")) or base_dir / "content"
 tmp_dir = base_dir / "tmp"
 log_dir = base_dir / "logs"
 
+# number of worker processes for image normalization, 0 means one per cpu core
+workers = processing_config.get("workers") or os.cpu_count() or 1
+# estimated size ceiling of one upload zip, 0 means only the count limit applies
+max_zip_bytes = int(processing_config.get("max_zip_mb", 0) * 1024 * 1024) or None
+# normalized images cached across runs, 0 disables the cache
+image_cache_bytes = int(processing_config.get("cache_mb", 0) * 1024 * 1024)
+image_cache_dir = tmp_dir / "image_cache" if image_cache_bytes else None
+# strip metadata from compliant JPEGs that are zipped without re-encoding
+strip_metadata = bool(processing_config.get("strip_metadata", True))
+# reject images off a 1:1 aspect ratio unless their border is white
+validate_border = bool(processing_config.get("validate_border", True))
+
 content_dir.mkdir(parents=True, exist_ok=True)
 tmp_dir.mkdir(parents=True, exist_ok=True)
 log_dir.mkdir(parents=True, exist_ok=True)
 
+# connection pool and timeouts of the uploader session
+http_max_connections = int(http_config.get("max_connections", 10))
+http_max_keepalive_connections = int(http_config.get("max_keepalive_connections", 5))
+http_keepalive_expiry = http_config.get("keepalive_expiry", 60)
+http_timeout = http_config.get("timeout", 60)
+http_connect_timeout = http_config.get("connect_timeout", 10)
+
+# batches of a key that are uploaded and imported at the same time
+upload_concurrency = max(1, int(upload_config.get("concurrency", 3)))
+# reuse excel templates exported earlier in the session
+upload_reuse_templates = bool(upload_config.get("reuse_templates", False))
+
+# status polling of zip and excel imports, delays in seconds
+poll_initial = polling_config.get("initial", 2)
+poll_factor = polling_config.get("factor", 1.5)
+poll_max_interval = polling_config.get("max_interval", 30)
+poll_jitter = polling_config.get("jitter", 0.2)
+poll_deadline = polling_config.get("deadline", 1800)
+
+# retries of uploader steps, delays and budgets in seconds
+retry_attempts = max(1, int(retry_config.get("attempts", 4)))
+retry_initial = retry_config.get("initial", 2)
+retry_factor = retry_config.get("factor", 2)
+retry_max_delay = retry_config.get("max_delay", 60)
+retry_jitter = retry_config.get("jitter", 0.2)
+retry_budget = retry_config.get("budget", 300)
+retry_budgets: dict[str, float] = retry_config.get("budgets", {})
+breaker_threshold = max(1, int(retry_config.get("breaker_threshold", 5)))
+breaker_reset = retry_config.get("breaker_reset", 60)
+
+# client side rate limits of admin requests, in requests per second
+ratelimit_light_rate = ratelimit_config.get("light_rate", 2)
+ratelimit_light_burst = ratelimit_config.get("light_burst", 4)
+ratelimit_heavy_rate = ratelimit_config.get("heavy_rate", 0.5)
+ratelimit_heavy_burst = ratelimit_config.get("heavy_burst", 2)
+ratelimit_min_factor = ratelimit_config.get("min_factor", 0.1)
+ratelimit_slow_response = ratelimit_config.get("slow_response", 10)
+
+# logging of the app, see config_logger
+log_queue = bool(logging_config.get("queue", False))
+log_format = logging_config.get("format", "text")
+log_rotate = logging_config.get("rotate", "none")
+log_max_bytes = int(logging_config.get("max_mb", 50) * 1024 * 1024)
+log_backups = int(logging_config.get("backups", 10))
+
+
+def _file_handler(level: int) -> dict:
+    handler = {
+        "level": level,
+        "filename": log_dir / "app.log",
+        "formatter": "json" if log_format == "json" else "standard",
+        "filters": ["context"],
+    }
+    if log_rotate == "size":
+        handler["class"] = "logging.handlers.RotatingFileHandler"
+        handler["maxBytes"] = log_max_bytes
+        handler["backupCount"] = log_backups
+    elif log_rotate == "time":
+        handler["class"] = "logging.handlers.TimedRotatingFileHandler"
+        handler["when"] = "midnight"
+        handler["backupCount"] = log_backups
+    else:
+        handler["class"] = "logging.FileHandler"
+    return handler
+
 
 def config_logger(level: int = logging.INFO):
+    """
+    Log to the console and logs/app.log as configured in [logging]. With
+    `queue` the loggers only enqueue records, and a listener thread formats
+    and writes them, so logging never blocks the event loop on disk.
+    """
+    handlers = ["queue"] if log_queue else ["console", "file"]
     log_config = {
         "formatters": {
             "standard": {
                 "format": "[{levelname} : {filename:>15}:{lineno:4} : {asctime} -> "
                 "{funcName:>18}] {message}",
                 "style": "{",
-            }
+            },
+            "json": {"()": logcontext.JsonFormatter},
+        },
+        "filters": {
+            "context": {"()": logcontext.ContextFilter},
         },
         "handlers": {
             "console": {
@@ -36,25 +136,33 @@ def config_logger(level: int = logging.INFO):
                 "level": level,
                 "formatter": "standard",
             },
-            "file": {
-                "class": "logging.FileHandler",
-                "level": level,
-                "filename": log_dir / "app.log",
-                "formatter": "standard",
-            },
+            "file": _file_handler(level),
         },
         "loggers": {
             "": {
-                "handlers": ["console", "file"],
+                "handlers": handlers,
                 "level": "INFO",
                 "propagate": True,
             },
             "httpx": {
-                "handlers": ["console", "file"],
+                "handlers": handlers,
                 "level": "WARNING",
                 "propagate": True,
             },
         },
         "version": 1,
     }
+    if log_queue:
+        log_config["handlers"]["queue"] = {
+            "class": f"{logcontext.__name__}.QueueHandler",
+            "handlers": ["console", "file"],
+            "respect_handler_level": True,
+            "filters": ["context"],
+        }
     logging.config.dictConfig(log_config)
+
+    if log_queue:
+        listener = logging.getHandlerByName("queue").listener
+        listener.start()
+        # flush the queue on exit
+        atexit.register(listener.stop)
@@ -0,0 +1,147 @@
+import re
+from collections.abc import Callable
+from html.parser import HTMLParser
+
+SCRIPT_PATTERN = re.compile(r"<script\b[^>]*>(.*?)</script\s*>", re.S | re.I)
+TABLE_FORM_PATTERN = re.compile(r"""\bid\s*=\s*["']?tableForm\b""")
+
+
+class _StopParsing(Exception):
+    pass
+
+
+class _FirstTagParser(HTMLParser):
+    """Find the attributes of the first `tag` whose attributes match."""
+
+    def __init__(self, tag: str, match: Callable[[dict], bool]):
+        super().__init__()
+        self.tag = tag
+        self.match = match
+        self.attrs: dict[str, str | None] | None = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag != self.tag:
+            return
+        attrs = dict(attrs)
+        if self.match(attrs):
+            self.attrs = attrs
+            raise _StopParsing
+
+
+class _TableParser(HTMLParser):
+    """
+    Collect the text of the cells of each row of the first table inside the
+    element the fed html starts with, and stop at the end of either.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.rows: list[list[str]] = []
+        self._container: str | None = None
+        self._container_depth = 0
+        self._table_depth = 0
+        self._cell: list[str] | None = None
+
+    def _close_cell(self):
+        if self._cell is not None and self.rows:
+            self.rows[-1].append("".join(self._cell).strip())
+        self._cell = None
+
+    def handle_starttag(self, tag, attrs):
+        if self._container is None:
+            self._container = tag
+        if tag == self._container:
+            self._container_depth += 1
+
+        if tag == "table":
+            self._table_depth += 1
+        elif not self._table_depth:
+            return
+        elif tag == "tr":
+            self._close_cell()
+            self.rows.append([])
+        elif tag in ("td", "th"):
+            self._close_cell()
+            # header cells are closed but not kept, like find_all("td")
+            self._cell = [] if tag == "td" else None
+
+    def handle_endtag(self, tag):
+        if not self._table_depth:
+            if tag == self._container:
+                self._container_depth -= 1
+                if not self._container_depth:
+                    raise _StopParsing
+            return
+        if tag in ("td", "th", "tr"):
+            self._close_cell()
+        elif tag == "table":
+            self._close_cell()
+            self._table_depth -= 1
+            if not self._table_depth:
+                raise _StopParsing
+
+    def handle_data(self, data):
+        if self._cell is not None:
+            self._cell.append(data)
+
+
+def _feed(parser: HTMLParser, html: str):
+    try:
+        parser.feed(html)
+        parser.close()
+    except _StopParsing:
+        pass
+
+
+def table_rows(html: str, name_column: int) -> dict[str, list[str]]:
+    """
+    Map the name in `name_column` of each row of the first table inside
+    `#tableForm` to the stripped text of its `<td>` cells. Only the first row
+    of a name is kept. Parsing starts at `#tableForm` and stops at the end of
+    its table, the rest of the page is never tokenized.
+    """
+    match = TABLE_FORM_PATTERN.search(html)
+    if not match:
+        return {}
+
+    parser = _TableParser()
+    _feed(parser, html[html.rfind("<", 0, match.start()) :])
+
+    rows: dict[str, list[str]] = {}
+    for cells in parser.rows:
+        if len(cells) > name_column:
+            rows.setdefault(cells[name_column], cells)
+    return rows
+
+
+def first_tag_attrs(html: str, tag: str, **attrs: str) -> dict[str, str | None] | None:
+    """Attributes of the first `tag` having all of `attrs`, or None."""
+    parser = _FirstTagParser(
+        tag, lambda found: all(found.get(k) == v for k, v in attrs.items())
+    )
+    _feed(parser, html)
+    return parser.attrs
+
+
+def first_link_href(html: str) -> str | None:
+    attrs = first_tag_attrs(html, "a")
+    return attrs.get("href") if attrs else None
+
+
+def input_value(html: str, name: str) -> str | None:
+    attrs = first_tag_attrs(html, "input", name=name)
+    return attrs.get("value") if attrs else None
+
+
+def script_redirect_url(html: str, url_pattern: str | re.Pattern) -> str | None:
+    """
+    The first `url_pattern` match inside the first script that assigns
+    `window.location.href`.
+    """
+    for script in SCRIPT_PATTERN.finditer(html):
+        text = script.group(1)
+        if "window.location.href" not in text:
+            continue
+        match = re.search(url_pattern, text)
+        return match.group(0) if match else None
+    return None
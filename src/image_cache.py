@@ -0,0 +1,59 @@
+import hashlib
+import logging
+import os
+from pathlib import Path
+
+
+def cache_key(data: bytes, params: str) -> str:
+    """Content address of a source file under the given normalization params."""
+    digest = hashlib.sha256(data)
+    digest.update(params.encode())
+    return digest.hexdigest()
+
+
+def cache_path(cache_dir: Path, key: str) -> Path:
+    return cache_dir / key[:2] / f"{key}.jpg"
+
+
+def get(cache_dir: Path, key: str) -> bytes | None:
+    path = cache_path(cache_dir, key)
+    try:
+        data = path.read_bytes()
+    except FileNotFoundError:
+        return None
+
+    # the mtime is the recency used for LRU eviction
+    os.utime(path)
+    return data
+
+
+def put(cache_dir: Path, key: str, data: bytes):
+    path = cache_path(cache_dir, key)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, path)
+
+
+def evict(cache_dir: Path, max_bytes: int) -> int:
+    """Delete least recently used entries until the cache fits `max_bytes`."""
+    entries = []
+    for path in cache_dir.glob("*/*.jpg"):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        path.unlink(missing_ok=True)
+        total -= size
+        removed += 1
+
+    if removed:
+        logging.info(f"Evicted {removed} entries from image cache {cache_dir}")
+    return removed
@@ -1,5 +1,6 @@
 import base64
 import itertools
+import math
 import mimetypes
 import re
 from fractions import Fraction
@@ -8,7 +9,7 @@ from pathlib import Path
 from typing import Literal
 
 import httpx
-from PIL import ExifTags, Image, ImageFile
+from PIL import ExifTags, Image, ImageChops, ImageFile
 
 
 def rgb_to_hex(rgb):
@@ -180,9 +181,12 @@ def split_image(image: Image.Image, sections=(2, 2), **kwargs) -> list[Image.Ima
 
 
 def is_aspect_ratio_valid(
-    image: Image.Image, *, target_ratio: float = 1, tolerance: float = 0.05
+    image: Image.Image | tuple[int, int],
+    *,
+    target_ratio: float = 1,
+    tolerance: float = 0.05,
 ) -> bool:
-    width, height = image.size
+    width, height = image if isinstance(image, tuple) else image.size
     aspect_ratio = width / height
     if aspect_ratio > (target_ratio + tolerance) or aspect_ratio < (
         target_ratio - tolerance
@@ -191,22 +195,81 @@ def is_aspect_ratio_valid(
     return True
 
 
-def has_white_border(image: Image.Image, *, ratio: float = 0.9) -> bool:
-    # check if 90% of pixels of side pixels are white (lighter than 250, 250, 250)
-    width, height = image.size
+def flatten_on_white(image: Image.Image) -> Image.Image:
+    """
+    `image` as an L or RGB image, with transparent pixels composited on
+    white the way `convert_image` flattens them for JPEG.
+    """
+    if image.mode in ("L", "RGB"):
+        return image
+    if image.mode in ("LA", "PA", "La", "RGBa") or (
+        image.mode == "P" and "transparency" in image.info
+    ):
+        image = image.convert("RGBA")
+    if image.mode == "RGBA":
+        return convert_image(image, "JPEG")
+    return image.convert("RGB")
+
+
+def _white_mask(image: Image.Image, threshold: int) -> Image.Image:
+    """Mode L mask of an L or RGB image, 255 where every band is above `threshold`."""
+    lut = [255 if v > threshold else 0 for v in range(256)]
+    mask = None
+    for band in image.split():
+        band = band.point(lut)
+        mask = band if mask is None else ImageChops.darker(mask, band)
+    return mask
+
+
+def border_white_fractions(
+    image: Image.Image,
+    *,
+    threshold: int = 240,
+    depth: int = 1,
+    max_side: int | None = None,
+) -> dict[str, float]:
+    """
+    Fraction of white pixels, i.e. with every channel above `threshold`, in
+    the `depth` pixels wide strip along each side of `image`. Transparent
+    pixels are seen on white, as they end up in the zip.
 
-    pixels = []
-    for i in range(width):
-        pixels.append(image.getpixel((i, 0)))
-        pixels.append(image.getpixel((i, height - 1)))
-    for j in range(height):
-        pixels.append(image.getpixel((0, j)))
-        pixels.append(image.getpixel((width - 1, j)))
+    Works on any mode using Pillow's native band operations, no pixel is read
+    from Python. `max_side` analyzes a copy reduced to fit it, which is much
+    cheaper for large images and barely changes the fractions.
+    """
+    image = flatten_on_white(image)
+    if max_side and max(image.size) > max_side:
+        image = image.reduce(math.ceil(max(image.size) / max_side))
 
-    white_pixels = [p for p in pixels if all(x > 240 for x in p)]
-    if len(white_pixels) / len(pixels) > ratio:
-        return True
-    return False
+    width, height = image.size
+    depth = max(1, min(depth, width, height))
+    strips = {
+        "top": (0, 0, width, depth),
+        "bottom": (0, height - depth, width, height),
+        "left": (0, 0, depth, height),
+        "right": (width - depth, 0, width, height),
+    }
+    fractions = {}
+    for side, box in strips.items():
+        histogram = _white_mask(image.crop(box), threshold).histogram()
+        fractions[side] = histogram[255] / sum(histogram)
+    return fractions
+
+
+def has_white_border(
+    image: Image.Image,
+    *,
+    ratio: float = 0.9,
+    threshold: int = 240,
+    max_side: int | None = None,
+) -> bool:
+    # check if 90% of pixels of side pixels are white (lighter than 240, 240, 240)
+    width, height = image.size
+    fractions = border_white_fractions(image, threshold=threshold, max_side=max_side)
+    white = (fractions["top"] + fractions["bottom"]) * width + (
+        fractions["left"] + fractions["right"]
+    ) * height
+    return white / (2 * (width + height)) > ratio
 
 
 def square_pad_white_pixels(image: Image.Image) -> Image.Image:
@@ -278,6 +341,52 @@ def strip_metadata(
     return convert_image(image, format)
 
 
+def strip_jpeg_metadata(data: bytes) -> bytes:
+    """
+    Drop the EXIF/XMP/IPTC application segments and comments of a JPEG file
+    without decoding it. JFIF (APP0), ICC profile (APP2) and Adobe (APP14)
+    segments are kept since they affect how the pixels are rendered.
+
+    Raises ValueError on anything but a well formed segment, junk bytes
+    between segments and truncated segments included.
+    """
+    if data[:2] != b"\xff\xd8":
+        raise ValueError("Not a JPEG file")
+
+    parts = [data[:2]]
+    pos = 2
+    while pos < len(data):
+        if data[pos] != 0xFF or pos + 1 >= len(data):
+            raise ValueError("Invalid JPEG marker")
+
+        marker = data[pos + 1]
+        if marker == 0xFF:  # fill byte
+            pos += 1
+            continue
+
+        if marker == 0xDA:  # start of scan, the rest is entropy coded data
+            parts.append(data[pos:])
+            break
+
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:  # standalone markers
+            parts.append(data[pos : pos + 2])
+            pos += 2
+            continue
+
+        length = int.from_bytes(data[pos + 2 : pos + 4], "big")
+        if length < 2 or pos + 2 + length > len(data):
+            raise ValueError("Truncated JPEG segment")
+        segment = data[pos : pos + 2 + length]
+        is_metadata = marker == 0xFE or (0xE1 <= marker <= 0xEF and marker != 0xEE)
+        if marker == 0xE2 and segment[4:16] == b"ICC_PROFILE\x00":
+            is_metadata = False
+        if not is_metadata:
+            parts.append(segment)
+        pos += 2 + length
+
+    return b"".join(parts)
+
+
 def image_to_base64(
     image: Image.Image,
     format: Literal["JPEG", "PNG", "WEBP", "BMP", "GIF"] = "JPEG",
@@ -0,0 +1,100 @@
+import json
+import sqlite3
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+from . import config
+
+# the steps of one batch in the order they complete
+STEPS = (
+    "zip_uploaded",
+    "zip_submitted",
+    "zip_done",
+    "template_exported",
+    "excel_uploaded",
+    "excel_submitted",
+    "excel_imported",
+    "post_processed",
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkpoints (
+    key TEXT NOT NULL,
+    batch INTEGER NOT NULL,
+    step TEXT NOT NULL,
+    data TEXT,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (key, batch, step)
+)
+"""
+
+
+class UploadJournal:
+    """
+    Checkpoints of every upload batch in a SQLite database. Each completed
+    step is committed with the data later steps need (upload ids, exported
+    file info...), so a retried or restarted upload continues a batch after
+    its last completed step instead of uploading it again.
+    """
+
+    def __init__(self, path: Path):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        with self.connection:
+            self.connection.execute(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def batch(self, key: str, index: int) -> "BatchJournal":
+        rows = self.connection.execute(
+            "SELECT step, data FROM checkpoints WHERE key = ? AND batch = ?",
+            (key, index),
+        )
+        steps = {step: json.loads(data) for step, data in rows}
+        return BatchJournal(self, key, index, steps)
+
+    def save(self, key: str, index: int, step: str, data: Any = None):
+        if step not in STEPS:
+            raise ValueError(f"Unknown upload step {step!r}")
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?)",
+                (key, index, step, json.dumps(data), time.time()),
+            )
+
+
+@dataclass(slots=True)
+class BatchJournal:
+    """The checkpoints of one batch, `steps` maps each completed step to its data."""
+
+    journal: UploadJournal
+    key: str
+    index: int
+    steps: dict[str, Any] = field(default_factory=dict)
+
+    def done(self, step: str) -> bool:
+        return step in self.steps
+
+    def get(self, step: str) -> Any:
+        return self.steps.get(step)
+
+    def record(self, step: str, data: Any = None):
+        self.journal.save(self.key, self.index, step, data)
+        self.steps[step] = data
+
+    @property
+    def last_step(self) -> str | None:
+        return next((s for s in reversed(STEPS) if s in self.steps), None)
+
+
+def open_journal() -> UploadJournal:
+    return UploadJournal(config.tmp_dir / "upload_journal.sqlite3")
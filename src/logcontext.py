@@ -0,0 +1,104 @@
+import copy
+import json
+import logging
+import logging.handlers
+from collections.abc import Generator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+
+# fields every log record carries, None outside of their scope
+FIELDS = ("key", "batch", "step")
+
+_context: ContextVar[dict | None] = ContextVar("log_context", default=None)
+
+
+@contextmanager
+def bind(**fields) -> Generator[None]:
+    """Attach `fields` to the records logged inside the block, tasks included."""
+    token = _context.set({**(_context.get() or {}), **fields})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    """
+    Copy the bound fields onto each record. It runs in the thread that logs,
+    so with a queue handler the fields are captured before the record is
+    handed to the listener.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        context = _context.get() or {}
+        for field in FIELDS:
+            if not hasattr(record, field):
+                setattr(record, field, context.get(field))
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, with the bound fields as keys."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": datetime.fromtimestamp(record.created).isoformat(
+                timespec="milliseconds"
+            ),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "location": f"{record.filename}:{record.lineno}:{record.funcName}",
+        }
+        for field in FIELDS:
+            data[field] = getattr(record, field, None)
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            data["exc_info"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class QueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler that keeps the traceback apart from the message, in
+    `exc_text`, so the listener's formatter decides how to render it.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+
+class _Forwarder(logging.Handler):
+    def emit(self, record: logging.LogRecord):
+        logging.getLogger(record.name).handle(record)
+
+
+def init_worker(queue, level: int):
+    """Process pool initializer that sends the worker's records to `queue`."""
+    root = logging.getLogger()
+    root.handlers = [QueueHandler(queue)]
+    root.setLevel(level)
+
+
+@contextmanager
+def forward_logs(context) -> Generator[tuple]:
+    """
+    Log the records of worker processes started by the `context` pool in
+    this process, through this process's handlers. Yields the initargs of
+    `init_worker`; stop the pool before leaving the block.
+    """
+    queue = context.Queue()
+    listener = logging.handlers.QueueListener(queue, _Forwarder())
+    listener.start()
+    try:
+        yield queue, logging.getLogger().getEffectiveLevel()
+    finally:
+        listener.stop()
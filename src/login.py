@@ -1,25 +1,96 @@
+import asyncio
+import json
 import logging
 import os
-import re
+import time
+from contextvars import ContextVar
+from pathlib import Path
 
 import httpx
-from bs4 import BeautifulSoup
 
+from . import config, htmlparse, metrics
+
+
+def cookies_path() -> Path:
+    return config.tmp_dir / "cookies.json"
+
+
+def save_cookies(cookies: httpx.Cookies, path: Path | None = None):
+    """Persist the session cookies with their expiry, readable by the owner only."""
+    path = path or cookies_path()
+    data = [
+        {
+            "name": cookie.name,
+            "value": cookie.value,
+            "domain": cookie.domain,
+            "path": cookie.path,
+            "expires": cookie.expires,
+        }
+        for cookie in cookies.jar
+    ]
+    tmp_path = path.with_suffix(".tmp")
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with open(fd, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def load_cookies(path: Path | None = None) -> httpx.Cookies | None:
+    """The saved cookies that have not expired yet, or None if there are none."""
+    try:
+        with open(path or cookies_path(), encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    cookies = httpx.Cookies()
+    now = time.time()
+    for cookie in data:
+        if cookie["expires"] is not None and cookie["expires"] <= now:
+            continue
+        cookies.set(
+            cookie["name"],
+            cookie["value"],
+            domain=cookie["domain"],
+            path=cookie["path"],
+        )
+    return cookies if cookies.jar else None
+
+
+# set while a login is in flight, its own redirects are not session expiries
+_in_login: ContextVar[bool] = ContextVar("in_login", default=False)
+
+
+def is_login_redirect(response: httpx.Response | None) -> bool:
+    """Whether the admin answered with a redirect to the login page."""
+    if response is None or not response.is_redirect:
+        return False
+    return "/login/accounts/auth" in response.headers.get("location", "")
+
+
+class AuthenticatedClient(httpx.AsyncClient):
+    """
+    Async client logged in to the admin through SSO. The login goes through
+    the client's own connection pool.
+
+    Sessions expire on the server: a request answered with a redirect to the
+    login page logs in again and is replayed with the new cookies. Requests
+    that hit the redirect together share a single login, and a request built
+    before a login, such as one held back by a rate limiter, is sent with the
+    new cookies.
+    """
 
-class AuthenticatedClient(httpx.Client):
     email = os.getenv("DIGIKALA_EMAIL")
     password = os.getenv("DIGIKALA_PASSWORD")
     proxy = os.getenv("DIGIKALA_PROXY")
 
     def __init__(self, **kwargs):
-        super().__init__(
-            proxy=self.proxy,
-            headers={"Content-Type": "application/x-www-form-urlencoded"},
-            verify=False,
-            **kwargs,
-        )
+        super().__init__(proxy=self.proxy, **kwargs)
+        self._login_lock = asyncio.Lock()
+        # bumped by every login, to tell whether a request predates it
+        self.login_generation = 0
 
-    def login(self):
+    async def login(self):
         url = "https://sso.digikala.com/auth/"
         params = {
             "return_url": "https://admin.digikala.com/login/accounts/callback",
@@ -30,53 +101,74 @@ class AuthenticatedClient(httpx.Client):
             "login[password]": self.password,
         }
 
-        response = self.post(
-            url,
-            data=payload,
-            params=params,
-            # headers=self.headers,
-            timeout=10,
-        )
-
-        headers = dict(response.headers or {})
-        redirect_url = headers.get("location")
-        if redirect_url:
-            response = self.get(redirect_url, timeout=30)
-            self.cookies = response.cookies
-            logging.info(f"Redirected to header location {response.cookies}")
-            return response
-
-        soup = BeautifulSoup(response.text, "html.parser")
-        soup.find_all("script")
-
-        redirect_url = None
-        for script in soup.find_all("script"):
-            if "window.location.href" in script.text:
+        token = _in_login.set(True)
+        try:
+            response = await self.post(
+                url,
+                data=payload,
+                params=params,
+                timeout=10,
+            )
+
+            headers = dict(response.headers or {})
+            redirect_url = headers.get("location")
+            if redirect_url:
+                logging.info("Redirected to header location")
+            else:
                 # Extract URL starting with https://admin.digikala.com/login/
-                url_match = re.search(
-                    r'https://admin\.digikala\.com/login/[^"]+', script.text
+                redirect_url = htmlparse.script_redirect_url(
+                    response.text, r'https://admin\.digikala\.com/login/[^"]+'
                 )
-                if url_match:
-                    redirect_url = url_match.group(0)
-                    logging.info("Login successful")
-                break
+                if not redirect_url:
+                    raise Exception("Failed to login")
+                logging.info("Login successful")
 
-        if not redirect_url:
-            raise Exception("Failed to login")
+            response = await self.get(redirect_url, timeout=30)
+        finally:
+            _in_login.reset(token)
 
-        response = self.get(redirect_url, timeout=30)
         self.cookies = response.cookies
+        save_cookies(self.cookies)
+        self.login_generation += 1
+        metrics.increment("session.logins")
         return response
 
-    def check_login_redirect(self, response: httpx.Response):
-        if response is None:
-            return False
+    async def relogin(self, generation: int):
+        """Log in again, unless another request did since `generation`."""
+        async with self._login_lock:
+            if self.login_generation == generation:
+                logging.info("Session expired, logging in again")
+                await self.login()
+
+    def build_request(self, *args, **kwargs) -> httpx.Request:
+        request = super().build_request(*args, **kwargs)
+        # the login whose cookies the request carries
+        request.extensions["login_generation"] = self.login_generation
+        return request
+
+    def _set_cookies(self, request: httpx.Request):
+        request.headers.pop("Cookie", None)
+        self.cookies.set_cookie_header(request)
+        request.extensions["login_generation"] = self.login_generation
+
+    async def send(self, request: httpx.Request, **kwargs) -> httpx.Response:
+        generation = request.extensions.get("login_generation", self.login_generation)
+        if generation != self.login_generation and not _in_login.get():
+            # a login happened while the request waited to be sent
+            self._set_cookies(request)
+            generation = self.login_generation
+
+        response = await super().send(request, **kwargs)
+        if _in_login.get() or not self.check_login_redirect(response):
+            return response
 
-        headers = dict(response.headers or {})
-        if response.status_code == 302:
-            return "/login/accounts/auth" in headers.get("location")
+        await response.aclose()
+        await self.relogin(generation)
+        self._set_cookies(request)
+        return await super().send(request, **kwargs)
 
-        return True
+    def check_login_redirect(self, response: httpx.Response):
+        return is_login_redirect(response)
 
 
 if __name__ == "__main__":
@@ -89,4 +181,4 @@ if __name__ == "__main__":
     print(os.getenv("DIGIKALA_PROXY"))
     
     client = AuthenticatedClient()
-    response = client.login()
+    response = asyncio.run(client.login())
@@ -0,0 +1,62 @@
+import logging
+import threading
+from collections import defaultdict, deque
+
+# observations kept per histogram, older ones are dropped
+HISTOGRAM_SIZE = 1000
+
+_lock = threading.Lock()
+_counters: dict[str, float] = defaultdict(float)
+_histograms: dict[str, deque[float]] = defaultdict(lambda: deque(maxlen=HISTOGRAM_SIZE))
+
+
+def increment(name: str, value: float = 1):
+    with _lock:
+        _counters[name] += value
+
+
+def gauge(name: str, value: float):
+    """Set `name` to its current `value`, like a rate or a queue length."""
+    with _lock:
+        _counters[name] = value
+
+
+def get(name: str) -> float:
+    with _lock:
+        return _counters.get(name, 0)
+
+
+def observe(name: str, value: float):
+    with _lock:
+        _histograms[name].append(value)
+
+
+def percentile(values: list[float], q: float) -> float:
+    """Nearest-rank percentile of `values`, `q` in [0, 1]."""
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def snapshot() -> dict[str, float]:
+    """
+    Return a copy of every metric recorded in this process. Histograms are
+    summarized as `<name>.count`, `.p50`, `.p90` and `.max`.
+    """
+    with _lock:
+        result = dict(_counters)
+        histograms = {name: list(values) for name, values in _histograms.items()}
+
+    for name, values in histograms.items():
+        result[f"{name}.count"] = len(values)
+        result[f"{name}.p50"] = percentile(values, 0.5)
+        result[f"{name}.p90"] = percentile(values, 0.9)
+        result[f"{name}.max"] = max(values, default=0)
+    return result
+
+
+def log_metrics(prefix: str = ""):
+    for name, value in sorted(snapshot().items()):
+        if name.startswith(prefix):
+            logging.info(f"Metric {name}: {value:g}")
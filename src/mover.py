@@ -0,0 +1,84 @@
+import json
+import logging
+import os
+import shutil
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# destination directories moved into concurrently, renames on a NAS are
+# latency bound so a few in flight hide most of the round-trips
+MOVE_WORKERS = 8
+
+
+def uploaded_path(image_path: str) -> Path:
+    """Where an image under `not uploaded` goes once it is uploaded."""
+    src = Path(image_path)
+    return Path(str(src.parent).replace("not uploaded", "uploaded")) / src.name
+
+
+def _move_group(destination: Path, moves: list[tuple[Path, Path]]) -> int:
+    """Move files of one source directory into `destination`."""
+    destination.mkdir(parents=True, exist_ok=True)
+    try:
+        same_device = moves[0][0].parent.stat().st_dev == destination.stat().st_dev
+    except FileNotFoundError:
+        return 0
+
+    moved = 0
+    for src, dst in moves:
+        try:
+            if same_device:
+                os.replace(src, dst)
+            else:
+                shutil.move(src, dst)
+        except FileNotFoundError:
+            # moved already, by an earlier attempt or by hand
+            continue
+        moved += 1
+    return moved
+
+
+def _write_log(log_path: Path, moves: list[tuple[str, str]]):
+    tmp_path = log_path.with_suffix(".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(moves, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, log_path)
+
+
+def move_files(moves: list[tuple[str, str]], log_path: Path) -> int:
+    """
+    Move every (src, dst) pair and return how many files were moved.
+
+    The moves are first written to `log_path`, which is removed once they
+    are all done, so moves a crash interrupted can be replayed by
+    `reconcile`. Moves are grouped by destination directory, which is
+    created once, and the groups run in a thread pool. Within one
+    filesystem a file is renamed, across filesystems it is copied and
+    removed; sources that no longer exist are skipped, which makes a replay
+    safe.
+    """
+    _write_log(log_path, moves)
+
+    groups: dict[Path, list[tuple[Path, Path]]] = defaultdict(list)
+    for src, dst in moves:
+        groups[Path(dst).parent].append((Path(src), Path(dst)))
+
+    with ThreadPoolExecutor(max_workers=min(MOVE_WORKERS, len(groups) or 1)) as pool:
+        moved = sum(pool.map(lambda group: _move_group(*group), groups.items()))
+
+    log_path.unlink()
+    return moved
+
+
+def reconcile(directory: Path) -> int:
+    """Replay the move logs left in `directory` by interrupted moves."""
+    moved = 0
+    for log_path in sorted(directory.glob("moves_*.json")):
+        with open(log_path, encoding="utf-8") as f:
+            moves = json.load(f)
+        logging.warning(f"Replaying interrupted moves of {log_path.name}")
+        moved += move_files(moves, log_path)
+    return moved
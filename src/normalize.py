@@ -0,0 +1,296 @@
+import logging
+import math
+import multiprocessing
+import os
+import time
+import zipfile
+from collections.abc import Generator, Iterator
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from io import BytesIO
+from pathlib import Path
+from typing import BinaryIO
+
+from PIL import Image
+
+from . import image_cache, imagetools, logcontext, metrics
+from .scanner import ImageRecord
+
+MAX_SIDE = 2500
+# encoded size of a default quality JPEG product photo, per output pixel
+JPEG_BYTES_PER_PIXEL = 0.3
+# bump whenever normalized output changes, cached images are keyed by it
+NORMALIZE_VERSION = 3
+CACHE_PARAMS = f"v{NORMALIZE_VERSION}:{MAX_SIDE}:JPEG"
+
+
+@dataclass(slots=True, frozen=True)
+class NormalizeOptions:
+    cache_dir: Path | None = None
+    cache_max_bytes: int | None = None
+    # drop EXIF/XMP/comment segments from JPEGs that are passed through as is
+    strip_metadata: bool = True
+
+
+@dataclass(slots=True)
+class NormalizedImage:
+    data: bytes
+    pid: int
+    elapsed: float
+    cached: bool = False
+    passthrough: bool = False
+
+
+@dataclass(slots=True)
+class WorkerStats:
+    images: int = 0
+    busy: float = 0
+
+    @property
+    def throughput(self) -> float:
+        return self.images / self.busy if self.busy else 0
+
+
+@dataclass(slots=True)
+class PoolStats:
+    started: float = field(default_factory=time.perf_counter)
+    workers: dict[int, WorkerStats] = field(default_factory=dict)
+
+    def add(self, pid: int, elapsed: float):
+        stats = self.workers.setdefault(pid, WorkerStats())
+        stats.images += 1
+        stats.busy += elapsed
+
+    def log(self):
+        wall = time.perf_counter() - self.started
+        images = sum(s.images for s in self.workers.values())
+        for pid, stats in sorted(self.workers.items()):
+            logging.info(
+                f"Worker {pid}: {stats.images} images in {stats.busy:.1f}s "
+                f"({stats.throughput:.2f} img/s)"
+            )
+        logging.info(
+            f"Normalized {images} images with {len(self.workers)} workers "
+            f"in {wall:.1f}s ({images / wall if wall else 0:.2f} img/s)"
+        )
+
+
+def estimate_output_size(record: ImageRecord) -> int:
+    """
+    Estimate the encoded size of a normalized image from its header alone.
+    JPEG sources keep roughly their bytes per pixel, the white padding costs
+    next to nothing; other formats are priced per output pixel.
+    """
+    longest = max(record.width, record.height)
+    scale = min(1, MAX_SIDE / longest) ** 2
+    if record.format == "JPEG":
+        return int(record.size * scale)
+    return int(record.width * record.height * scale * JPEG_BYTES_PER_PIXEL)
+
+
+def normalize_image(image: Image.Image, name: str = "") -> Image.Image:
+    """
+    Shrink the image to fit MAX_SIDE, then pad it to a 1:1 aspect ratio.
+
+    Shrinking first means the full size padded canvas is never allocated, and
+    JPEGs are decoded at a reduced scale (1/2, 1/4 or 1/8) when that still
+    covers the target size, so the full resolution is never decoded either.
+    """
+    width, height = image.size
+    aspect_ratio = imagetools.get_aspect_ratio_str(width, height)
+    longest = max(width, height)
+    if longest > MAX_SIDE:
+        scale = MAX_SIDE / longest
+        image.draft(None, (math.ceil(width * scale), math.ceil(height * scale)))
+        if width >= height:
+            image = imagetools.resize_image(image, MAX_SIDE)
+        else:
+            image = imagetools.resize_image(image, None, MAX_SIDE)
+
+    if aspect_ratio != "1:1":
+        # padding drops the alpha channel, flatten transparent pixels first
+        image = imagetools.flatten_on_white(image)
+        # add white pixels to image to achieve 1:1 aspect ratio
+        image = imagetools.square_pad_white_pixels(image)
+        logging.warning(f"Aspect ratio {aspect_ratio} {name}")
+    return image
+
+
+def is_compliant(image: Image.Image) -> bool:
+    """Whether an opened source already is a square RGB JPEG within MAX_SIDE."""
+    width, height = image.size
+    return (
+        image.format == "JPEG" and image.mode == "RGB" and width == height <= MAX_SIDE
+    )
+
+
+def encode_image(
+    source: bytes, fp: BinaryIO, name: str = "", *, strip_metadata: bool = True
+) -> bool:
+    """
+    Normalize one source file into `fp` and return whether it was passed
+    through. Compliant JPEGs are copied without decoding their pixels, minus
+    their metadata segments if `strip_metadata`; the rest, and JPEGs whose
+    segments can not be stripped, are decoded, normalized and JPEG-encoded.
+    """
+    with Image.open(BytesIO(source)) as image:
+        if is_compliant(image):
+            try:
+                data = (
+                    imagetools.strip_jpeg_metadata(source) if strip_metadata else source
+                )
+            except ValueError as e:
+                # Pillow reads past junk between segments, the stripper does not
+                logging.warning(f"Re-encoding malformed JPEG {name}: {e}")
+            else:
+                fp.write(data)
+                return True
+
+        image = normalize_image(image, name)
+        imagetools.convert_image(image, "JPEG").save(fp, format="JPEG")
+        return False
+
+
+def normalize_file(
+    path: str, options: NormalizeOptions | None = None
+) -> NormalizedImage:
+    """
+    Worker entry point: normalize one source file into memory. With a cache
+    the output is looked up by source content hash first and stored there
+    after a miss; passed through images are never cached.
+    """
+    options = options or NormalizeOptions()
+    started = time.perf_counter()
+    source = Path(path).read_bytes()
+    key = image_cache.cache_key(source, CACHE_PARAMS) if options.cache_dir else None
+    if key:
+        data = image_cache.get(options.cache_dir, key)
+        if data is not None:
+            elapsed = time.perf_counter() - started
+            return NormalizedImage(data, os.getpid(), elapsed, cached=True)
+
+    buffer = BytesIO()
+    passthrough = encode_image(
+        source, buffer, path, strip_metadata=options.strip_metadata
+    )
+    if key and not passthrough:
+        image_cache.put(options.cache_dir, key, buffer.getvalue())
+    elapsed = time.perf_counter() - started
+    return NormalizedImage(
+        buffer.getvalue(), os.getpid(), elapsed, passthrough=passthrough
+    )
+
+
+def _queued_batches(
+    dicts: list[dict[str, str]],
+    executor: ProcessPoolExecutor | None,
+    options: NormalizeOptions,
+) -> Iterator[dict[str, Future] | None]:
+    """
+    Yield the futures of each batch in order, or None when encoding inline.
+    The next batch is queued before the current one is handed out, so the
+    pool never idles at batch boundaries.
+    """
+    if executor is None:
+        yield from (None for _ in dicts)
+        return
+
+    def submit(d: dict[str, str]) -> dict[str, Future]:
+        return {k: executor.submit(normalize_file, v, options) for k, v in d.items()}
+
+    pending = submit(dicts[0]) if dicts else {}
+    for i in range(len(dicts)):
+        current = pending
+        pending = submit(dicts[i + 1]) if i + 1 < len(dicts) else {}
+        yield current
+
+
+@contextmanager
+def _process_pool(workers: int) -> Generator[ProcessPoolExecutor | None]:
+    """
+    A pool of `workers` processes, or None for a single worker. A forked
+    worker would inherit this process's logging threads but not their
+    state, losing its records, so workers start fresh and send their
+    records back to be logged here.
+    """
+    if workers <= 1:
+        yield None
+        return
+
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context(
+        "forkserver" if "forkserver" in methods else "spawn"
+    )
+    with logcontext.forward_logs(context) as initargs:
+        executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=context,
+            initializer=logcontext.init_worker,
+            initargs=initargs,
+        )
+        try:
+            yield executor
+        finally:
+            executor.shutdown(cancel_futures=True)
+
+
+def _count(result: NormalizedImage, options: NormalizeOptions):
+    if result.passthrough:
+        metrics.increment("normalize.passthrough")
+    elif options.cache_dir is not None:
+        metrics.increment("image_cache.hits" if result.cached else "image_cache.misses")
+
+
+def write_zips(
+    dicts: list[dict[str, str]],
+    zip_paths: list[Path],
+    workers: int = 1,
+    options: NormalizeOptions | None = None,
+) -> list[Path]:
+    """
+    Normalize every image of every batch and stream it into that batch's zip
+    as `<dkp_id>.jpg`, in the order of `dicts` and of each batch's keys.
+
+    Entries are ZIP_STORED since JPEG data does not deflate. With one worker
+    and no cache the encoder writes straight into the archive entry;
+    otherwise images are normalized by `normalize_file`, in a process pool if
+    there are several workers, and their bytes are copied into the entry.
+    """
+    options = options or NormalizeOptions()
+    stats = PoolStats()
+    with _process_pool(workers) as executor:
+        batches = _queued_batches(dicts, executor, options)
+        for d, zip_path, futures in zip(dicts, zip_paths, batches, strict=True):
+            with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_STORED) as zipf:
+                for k, v in d.items():
+                    with zipf.open(f"{k}.jpg", "w") as entry:
+                        if futures is None and options.cache_dir is None:
+                            started = time.perf_counter()
+                            passthrough = encode_image(
+                                Path(v).read_bytes(),
+                                entry,
+                                v,
+                                strip_metadata=options.strip_metadata,
+                            )
+                            elapsed = time.perf_counter() - started
+                            result = NormalizedImage(
+                                b"", os.getpid(), elapsed, passthrough=passthrough
+                            )
+                        else:
+                            result = (
+                                futures[k].result()
+                                if futures
+                                else normalize_file(v, options)
+                            )
+                            entry.write(result.data)
+                        stats.add(result.pid, result.elapsed)
+                        _count(result, options)
+
+    stats.log()
+    metrics.log_metrics("normalize.")
+    if options.cache_dir is not None:
+        metrics.log_metrics("image_cache.")
+        if options.cache_max_bytes:
+            image_cache.evict(options.cache_dir, options.cache_max_bytes)
+    return zip_paths
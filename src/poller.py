@@ -0,0 +1,318 @@
+import asyncio
+import json
+import logging
+import math
+import random
+import weakref
+from collections import deque
+from collections.abc import Callable
+from dataclasses import dataclass
+from typing import Any
+
+import httpx
+
+from . import config, logcontext, metrics, retry
+
+# completion times remembered per table to plan the first poll of a job
+HISTORY_SIZE = 200
+
+
+class PollTimeoutError(TimeoutError):
+    def __init__(self, name: str, elapsed: float):
+        super().__init__(f"{name} still pending after {elapsed:.0f}s")
+        self.name = name
+        self.elapsed = elapsed
+
+
+@dataclass(slots=True, frozen=True)
+class PollingPolicy:
+    """
+    When to poll a job: exponential backoff from `initial` by `factor` up to
+    `max_interval`, each delay randomized by +/- `jitter`, and a job is given
+    up `deadline` seconds after it started waiting.
+    """
+
+    initial: float = 2
+    factor: float = 1.5
+    max_interval: float = 30
+    jitter: float = 0.2
+    deadline: float = 1800
+
+    def delay(self, attempt: int) -> float:
+        delay = min(self.max_interval, self.initial * self.factor**attempt)
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def first_delay(self, history: list[float]) -> float:
+        """
+        Few jobs finish faster than the quickest quarter of past ones, so the
+        first poll waits for that long before backing off from `initial`.
+        """
+        if not history:
+            return self.delay(0)
+        return min(self.deadline, max(self.delay(0), metrics.percentile(history, 0.25)))
+
+
+def default_policy() -> PollingPolicy:
+    return PollingPolicy(
+        initial=config.poll_initial,
+        factor=config.poll_factor,
+        max_interval=config.poll_max_interval,
+        jitter=config.poll_jitter,
+        deadline=config.poll_deadline,
+    )
+
+
+def _load_history() -> dict[str, list[float]]:
+    try:
+        with open(config.tmp_dir / "poll_history.json", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_history(label: str, history: deque[float]):
+    histories = _load_history()
+    histories[label] = list(history)
+    try:
+        with open(config.tmp_dir / "poll_history.json", "w", encoding="utf-8") as f:
+            json.dump(histories, f)
+    except OSError as e:
+        # only later first polls are planned from it, polling goes on
+        logging.warning(f"Could not save poll history: {e!r}")
+
+
+@dataclass(slots=True)
+class _Job:
+    future: asyncio.Future
+    started: float
+    next_poll: float
+    attempt: int = 0
+    # a finished result left by an earlier job under the same name
+    previous: Any = None
+    changed: bool = False
+
+
+class TablePoller:
+    """
+    Background poller of one admin table page shared by every pending job.
+
+    Each job is polled on its own `policy` schedule; the page is fetched when
+    the earliest job is due, its rows are parsed once by `rows` into
+    `{name: cells}` and every waiting name is resolved from that single
+    parse. `status(cells)` returns a truthy result when the job is finished,
+    a falsy one while it is pending, or raises if it failed. A name missing
+    from the table resolves to None, but only on a page requested after the
+    job started waiting. A fetch that fails, or answers with anything but
+    200 or 304, is tried again on the jobs' backoff; only a job past its
+    deadline fails, with PollTimeoutError.
+
+    Completion times are recorded under `label`, both as the
+    `poller.<label>.seconds` metric and in tmp/poll_history.json to plan the
+    first poll of later jobs. The server's ETag/Last-Modified validators are
+    sent back so an unchanged page can be answered with 304 and is not
+    parsed again; they are left out while a job waits that has not seen the
+    page yet, so every job is resolved on a page fetched after it started.
+    """
+
+    def __init__(
+        self,
+        client: httpx.AsyncClient,
+        url: str,
+        rows: Callable[[str], dict[str, list[str]]],
+        status: Callable[[list[str]], Any],
+        *,
+        label: str,
+        policy: PollingPolicy | None = None,
+    ):
+        # weak, the client owns its pollers through _pollers
+        self._client = weakref.ref(client)
+        self.url = url
+        self.rows = rows
+        self.status = status
+        self.label = label
+        self.policy = policy or default_policy()
+        self.history: deque[float] = deque(
+            _load_history().get(label, []), maxlen=HISTORY_SIZE
+        )
+        self._jobs: dict[str, list[_Job]] = {}
+        self._task: asyncio.Task | None = None
+        self._wakeup = asyncio.Event()
+        self._validators: dict[str, str] = {}
+        # when the fetch of the last page that was not a 304 started
+        self._page_started = -math.inf
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        client = self._client()
+        if client is None:
+            raise RuntimeError("The client of this poller was closed")
+        return client
+
+    async def wait(self, name: str, *, previous: Any = None):
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        job = _Job(
+            loop.create_future(),
+            started=now,
+            next_poll=now + self.policy.first_delay(list(self.history)),
+            previous=previous,
+        )
+        self._jobs.setdefault(name, []).append(job)
+        if self._task is None or self._task.done():
+            # the poller serves every batch, not the one that started it
+            with logcontext.bind(batch=None, step=None):
+                self._task = asyncio.create_task(self._run())
+        self._wakeup.set()
+        return await job.future
+
+    async def _fetch(self, fresh: bool) -> dict[str, list[str]] | None:
+        """Fetch and parse the table, or return None if it is unchanged."""
+        headers = {"Origin": "https://admin.digikala.com"}
+        if not fresh:
+            if etag := self._validators.get("etag"):
+                headers["If-None-Match"] = etag
+            if last_modified := self._validators.get("last-modified"):
+                headers["If-Modified-Since"] = last_modified
+
+        response = await self.client.get(self.url, headers=headers)
+        metrics.increment("poller.fetches")
+        if response.status_code == 304:
+            metrics.increment("poller.not_modified")
+            return None
+        if response.status_code != 200:
+            # an error page has no table, its rows would all look missing
+            retry.raise_for_server_error(response)
+            response.raise_for_status()
+
+        self._validators = {
+            k: response.headers[k]
+            for k in ("etag", "last-modified")
+            if k in response.headers
+        }
+        return self.rows(response.text)
+
+    def _complete(self, job: _Job, result, now: float):
+        if result:
+            elapsed = now - job.started
+            self.history.append(elapsed)
+            metrics.observe(f"poller.{self.label}.seconds", elapsed)
+            _save_history(self.label, self.history)
+        job.future.set_result(result or None)
+
+    def _reschedule(self, name: str, jobs: list[_Job], now: float):
+        """Back off the due jobs that are still pending, fail the overdue ones."""
+        for job in jobs:
+            if job.future.done():
+                continue
+            if now - job.started >= self.policy.deadline:
+                job.future.set_exception(PollTimeoutError(name, now - job.started))
+            elif job.next_poll <= now:
+                job.attempt += 1
+                job.next_poll = now + self.policy.delay(job.attempt)
+
+    def _resolve(self, rows: dict[str, list[str]], page_started: float):
+        now = asyncio.get_running_loop().time()
+        for name, jobs in self._jobs.items():
+            # a job that started waiting after the page was requested may
+            # not be on it yet, it waits for the next one
+            seen = [
+                job
+                for job in jobs
+                if job.started < page_started and not job.future.done()
+            ]
+            cells = rows.get(name)
+            try:
+                result = self.status(cells) if cells else None
+            except Exception as e:
+                for job in seen:
+                    job.future.set_exception(e)
+                continue
+
+            if result is None:
+                for job in seen:
+                    self._complete(job, None, now)
+                continue
+
+            pending = []
+            for job in seen:
+                if not result:
+                    job.changed = True
+                if result and (job.changed or result != job.previous):
+                    self._complete(job, result, now)
+                else:
+                    pending.append(job)
+            self._reschedule(name, pending, now)
+
+    def _prune(self):
+        for name, jobs in list(self._jobs.items()):
+            jobs[:] = [job for job in jobs if not job.future.done()]
+            if not jobs:
+                del self._jobs[name]
+
+    async def _run(self):
+        try:
+            await self._poll()
+        except Exception as e:
+            # never leave the waiting batches hanging on a dead poller
+            logging.exception(f"Poller of {self.url} failed")
+            for jobs in self._jobs.values():
+                for job in jobs:
+                    if not job.future.done():
+                        job.future.set_exception(e)
+            self._jobs.clear()
+
+    async def _poll(self):
+        loop = asyncio.get_running_loop()
+        while self._jobs:
+            due = min(job.next_poll for jobs in self._jobs.values() for job in jobs)
+            if due > loop.time():
+                # sleep until the earliest job is due, or a new job arrives
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), due - loop.time())
+                except TimeoutError:
+                    pass
+                continue
+
+            started = loop.time()
+            fresh = any(
+                job.started >= self._page_started
+                for jobs in self._jobs.values()
+                for job in jobs
+            )
+            try:
+                rows = await self._fetch(fresh)
+            except Exception as e:
+                metrics.increment("poller.failures")
+                logging.warning(f"Polling {self.url} failed: {e!r}")
+                rows = None
+
+            if rows is None:
+                # nothing new to resolve the jobs on, back off and try again
+                now = loop.time()
+                for name, jobs in self._jobs.items():
+                    self._reschedule(name, jobs, now)
+            else:
+                self._page_started = started
+                self._resolve(rows, started)
+            self._prune()
+
+
+_pollers: weakref.WeakKeyDictionary[httpx.AsyncClient, dict[str, TablePoller]] = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def get_poller(
+    client: httpx.AsyncClient,
+    url: str,
+    rows: Callable[[str], dict[str, list[str]]],
+    status: Callable[[list[str]], Any],
+    *,
+    label: str,
+) -> TablePoller:
+    """Return the poller of `url` for this client, creating it on first use."""
+    pollers = _pollers.setdefault(client, {})
+    if url not in pollers:
+        pollers[url] = TablePoller(client, url, rows, status, label=label)
+    return pollers[url]
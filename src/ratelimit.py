@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import time
+
+import httpx
+
+from . import config, metrics
+
+# additive increase of a rate per successful request, as a fraction of it
+INCREASE_STEP = 0.05
+
+
+class TokenBucket:
+    """
+    Token bucket that adapts its rate AIMD style: `congested` halves it,
+    down to `min_rate`, and every `succeeded` adds back a twentieth of
+    `max_rate`. Waiters are served in order. The current rate is the
+    `ratelimit.<name>.rate` metric.
+    """
+
+    def __init__(self, name: str, max_rate: float, burst: float, min_rate: float):
+        self.name = name
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.burst = burst
+        self.rate = max_rate
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        # a burst of congested responses to requests sent together counts once
+        self._decreased_at = 0.0
+        self._lock = asyncio.Lock()
+        metrics.gauge(f"ratelimit.{name}.rate", self.rate)
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        started = time.monotonic()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    break
+                await asyncio.sleep(
+                    max(self.paused_until - now, (1 - self.tokens) / self.rate)
+                )
+        metrics.observe(f"ratelimit.{self.name}.wait", time.monotonic() - started)
+
+    def _set_rate(self, rate: float):
+        self._refill(time.monotonic())
+        self.rate = rate
+        metrics.gauge(f"ratelimit.{self.name}.rate", rate)
+
+    def congested(self, retry_after: float | None = None):
+        now = time.monotonic()
+        metrics.increment(f"ratelimit.{self.name}.congested")
+        if retry_after:
+            self.paused_until = max(self.paused_until, now + retry_after)
+        if now - self._decreased_at < 1 / self.rate:
+            return
+
+        self._decreased_at = now
+        self._set_rate(max(self.min_rate, self.rate / 2))
+        logging.warning(f"Admin is throttling, {self.name} rate {self.rate:.2f}/s")
+
+    def succeeded(self):
+        if self.rate < self.max_rate:
+            self._set_rate(
+                min(self.max_rate, self.rate + self.max_rate * INCREASE_STEP)
+            )
+
+
+def _retry_after(response: httpx.Response) -> float | None:
+    try:
+        return float(response.headers["retry-after"])
+    except (KeyError, ValueError):
+        return None
+
+
+class RateLimiter:
+    """
+    Client side throttle shared by every admin request of a session, with
+    separate budgets for heavy multipart uploads and light requests such as
+    table polls and form posts. A 429 or 503 answer, a timeout, or a light
+    request slower than `slow_response` seconds slows its bucket down, a
+    Retry-After pauses it.
+    """
+
+    def __init__(self):
+        min_factor = config.ratelimit_min_factor
+        self.light = TokenBucket(
+            "light",
+            config.ratelimit_light_rate,
+            config.ratelimit_light_burst,
+            config.ratelimit_light_rate * min_factor,
+        )
+        self.heavy = TokenBucket(
+            "heavy",
+            config.ratelimit_heavy_rate,
+            config.ratelimit_heavy_burst,
+            config.ratelimit_heavy_rate * min_factor,
+        )
+        self.slow_response = config.ratelimit_slow_response
+
+    def bucket(self, request: httpx.Request) -> TokenBucket:
+        content_type = request.headers.get("content-type", "")
+        return self.heavy if content_type.startswith("multipart/") else self.light
+
+    def feedback(
+        self, bucket: TokenBucket, response: httpx.Response | None, elapsed: float
+    ):
+        """Adapt `bucket` to a response, None meaning the request timed out."""
+        if response is None:
+            bucket.congested()
+        elif response.status_code in (429, 503):
+            bucket.congested(_retry_after(response))
+        elif bucket is self.light and elapsed > self.slow_response:
+            bucket.congested()
+        else:
+            bucket.succeeded()
@@ -0,0 +1,153 @@
+import logging
+import sqlite3
+import time
+from collections.abc import Generator
+from contextlib import closing, contextmanager
+from pathlib import Path
+
+import pandas as pd
+
+from . import config
+
+COLUMNS = ("key", "original_image_path", "image_path", "status", "excel_upload_id")
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS uploads (
+    id INTEGER PRIMARY KEY,
+    key TEXT NOT NULL,
+    original_image_path TEXT NOT NULL,
+    image_path TEXT NOT NULL,
+    status TEXT NOT NULL,
+    excel_upload_id TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS uploads_key ON uploads (key);
+CREATE INDEX IF NOT EXISTS uploads_original_image_path
+    ON uploads (original_image_path);
+CREATE INDEX IF NOT EXISTS uploads_image_path ON uploads (image_path);
+"""
+INSERT = (
+    f"INSERT INTO uploads ({', '.join(COLUMNS)}, created_at) VALUES (?, ?, ?, ?, ?, ?)"
+)
+
+
+def default_path() -> Path:
+    return config.log_dir / "report.sqlite3"
+
+
+@contextmanager
+def connect(path: Path | None = None) -> Generator[sqlite3.Connection]:
+    """
+    Open the report store, creating it on first use. A new store imports the
+    rows of an existing logs/report.xlsx, the report it replaces.
+    """
+    path = path or default_path()
+    # the legacy import of the first connection may keep others waiting
+    with closing(sqlite3.connect(path, timeout=60)) as connection:
+        connection.executescript(SCHEMA)
+        _import_legacy(connection, path.with_name("report.xlsx"))
+        yield connection
+
+
+def _import_legacy(connection: sqlite3.Connection, xlsx_path: Path):
+    """
+    Import `xlsx_path` once per store. The check and the import share one
+    write transaction, so concurrent first connections import it only once;
+    PRAGMA user_version marks it done, and a store that already holds rows
+    predates the mark and was imported when it was created.
+    """
+    if connection.execute("PRAGMA user_version").fetchone()[0] >= 1:
+        return
+
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        if connection.execute("PRAGMA user_version").fetchone()[0] < 1:
+            has_rows = connection.execute("SELECT 1 FROM uploads LIMIT 1").fetchone()
+            if not has_rows and xlsx_path.exists():
+                _import_xlsx(connection, xlsx_path)
+            connection.execute("PRAGMA user_version = 1")
+        connection.commit()
+    except BaseException:
+        connection.rollback()
+        raise
+
+
+def _import_xlsx(connection: sqlite3.Connection, xlsx_path: Path):
+    df = pd.read_excel(xlsx_path, dtype=str).reindex(columns=COLUMNS)
+    rows = [
+        (*(None if pd.isna(v) else v for v in row), xlsx_path.stat().st_mtime)
+        for row in df.itertuples(index=False)
+    ]
+    connection.executemany(INSERT, rows)
+    logging.info(f"Imported {len(rows)} report rows from {xlsx_path}")
+
+
+def append(*, key: str, uploaded_images: list[str], excel_upload_id: str | None):
+    """Record the images of one uploaded batch, without reading past records."""
+    status = "success" if excel_upload_id else "failed"
+    created_at = time.time()
+    rows = [
+        (
+            key,
+            image_path,
+            image_path.replace("not uploaded", "uploaded"),
+            status,
+            excel_upload_id,
+            created_at,
+        )
+        for image_path in uploaded_images
+    ]
+    with connect() as connection, connection:
+        connection.executemany(INSERT, rows)
+
+
+def find_by_key(key: str) -> list[dict]:
+    return _select("key = ?", (key,))
+
+
+def find_by_image(image_path: str) -> list[dict]:
+    """Records of an image, by its path either before or after the upload."""
+    return _select(
+        "original_image_path = ? OR image_path = ?", (image_path, image_path)
+    )
+
+
+def _select(where: str, params: tuple) -> list[dict]:
+    with connect() as connection:
+        connection.row_factory = sqlite3.Row
+        rows = connection.execute(
+            f"SELECT {', '.join(COLUMNS)} FROM uploads WHERE {where} ORDER BY id",
+            params,
+        )
+        return [dict(row) for row in rows]
+
+
+def export_xlsx(output: Path, *, key: str | None = None) -> int:
+    """Write the records, or only those of `key`, to `output` as report.xlsx did."""
+    query = f"SELECT {', '.join(COLUMNS)} FROM uploads"
+    params: tuple = ()
+    if key:
+        query += " WHERE key = ?"
+        params = (key,)
+    with connect() as connection:
+        df = pd.read_sql_query(query + " ORDER BY id", connection, params=params)
+    df.to_excel(output, index=False)
+    return len(df)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Export the upload report")
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=Path,
+        default=config.log_dir / "report.xlsx",
+        help="xlsx file to write",
+    )
+    parser.add_argument("--key", help="only export the batches of this key")
+    args = parser.parse_args()
+
+    config.config_logger()
+    count = export_xlsx(args.output, key=args.key)
+    logging.info(f"Exported {count} report rows to {args.output}")
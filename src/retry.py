@@ -0,0 +1,176 @@
+import asyncio
+import functools
+import logging
+import random
+import time
+from dataclasses import dataclass
+
+import httpx
+
+from . import config, logcontext, metrics
+
+
+class PermanentError(Exception):
+    """A failure no retry can fix, like an upload the admin rejected as invalid."""
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+@dataclass(slots=True, frozen=True)
+class RetryPolicy:
+    """
+    How a step is retried: up to `attempts` tries with exponential backoff
+    from `initial` by `factor` up to `max_delay`, each delay randomized by
+    +/- `jitter`, and no try starts once `budget` seconds have passed since
+    the first one.
+    """
+
+    attempts: int = 4
+    initial: float = 2
+    factor: float = 2
+    max_delay: float = 60
+    jitter: float = 0.2
+    budget: float = 300
+
+    def delay(self, retry: int) -> float:
+        delay = min(self.max_delay, self.initial * self.factor**retry)
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+
+def policy_for(step: str) -> RetryPolicy:
+    return RetryPolicy(
+        attempts=config.retry_attempts,
+        initial=config.retry_initial,
+        factor=config.retry_factor,
+        max_delay=config.retry_max_delay,
+        jitter=config.retry_jitter,
+        budget=config.retry_budgets.get(step, config.retry_budget),
+    )
+
+
+class CircuitBreaker:
+    """
+    Shared by every step talking to the admin. After `threshold` failures
+    in a row it opens and holds every try back for `reset_timeout` seconds,
+    so a degraded server is not hit by the retries of all batches at once.
+    The first failure after that opens it again, a success closes it.
+    """
+
+    def __init__(self, threshold: int, reset_timeout: float):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.open_until = 0.0
+
+    def record_success(self):
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= self.threshold:
+            logging.warning(f"Circuit breaker open for {self.reset_timeout:g}s")
+            metrics.increment("retry.circuit_opened")
+            self.open_until = time.monotonic() + self.reset_timeout
+            # half open: one more failure is enough to open it again
+            self.failures = self.threshold - 1
+
+    async def wait(self, deadline: float):
+        """Wait while the breaker is open, or raise if that outlasts `deadline`."""
+        remaining = self.open_until - time.monotonic()
+        if remaining <= 0:
+            return
+        if time.monotonic() + remaining > deadline:
+            raise CircuitOpenError("Admin is failing, circuit breaker is open")
+        await asyncio.sleep(remaining)
+
+
+breaker = CircuitBreaker(config.breaker_threshold, config.breaker_reset)
+
+
+def raise_for_server_error(response: httpx.Response):
+    """Raise HTTPStatusError for 5xx and 429 responses, the retryable ones."""
+    if response.status_code >= 500 or response.status_code == 429:
+        raise httpx.HTTPStatusError(
+            f"Server error {response.status_code} for {response.url}",
+            request=response.request,
+            response=response,
+        )
+
+
+def is_transient(error: Exception, *, idempotent: bool = True) -> bool:
+    """
+    Whether a retry may succeed where `error` failed. A step that is not
+    `idempotent` is only retried when the server surely did not act on it:
+    the connection was never made, or it answered 429 or 503.
+    """
+    if isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+        if idempotent:
+            return status >= 500 or status == 429
+        return status in (429, 503)
+
+    if isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)):
+        return True
+    if isinstance(
+        error, (httpx.TimeoutException, httpx.NetworkError, httpx.RemoteProtocolError)
+    ):
+        return idempotent
+    return False
+
+
+async def _call(step: str, idempotent: bool, func, *args, **kwargs):
+    policy = policy_for(step)
+    deadline = time.monotonic() + policy.budget
+    attempt = 0
+    while True:
+        try:
+            await breaker.wait(deadline)
+        except CircuitOpenError:
+            metrics.increment(f"retry.{step}.give_ups")
+            raise
+
+        attempt += 1
+        metrics.increment(f"retry.{step}.attempts")
+        try:
+            result = await func(*args, **kwargs)
+        except Exception as e:
+            if not is_transient(e, idempotent=idempotent):
+                metrics.increment(f"retry.{step}.fail_fast")
+                raise
+
+            breaker.record_failure()
+            delay = policy.delay(attempt - 1)
+            if attempt >= policy.attempts or time.monotonic() + delay > deadline:
+                metrics.increment(f"retry.{step}.give_ups")
+                logging.error(f"Giving up {step} after {attempt} tries: {e!r}")
+                raise
+
+            metrics.increment(f"retry.{step}.retries")
+            logging.warning(
+                f"Try {attempt} of {step} failed, retrying in {delay:.1f}s: {e!r}"
+            )
+            await asyncio.sleep(delay)
+        else:
+            breaker.record_success()
+            return result
+
+
+def retrying(step: str, *, idempotent: bool = True):
+    """
+    Retry the decorated coroutine function by `policy_for(step)` while its
+    errors are transient; any other error is raised right away. Counts
+    `retry.<step>.attempts`, `.retries`, `.give_ups` and `.fail_fast`, and
+    logs inside the call carry `step`.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapped(*args, **kwargs):
+            with logcontext.bind(step=step):
+                return await _call(step, idempotent, func, *args, **kwargs)
+
+        return wrapped
+
+    return decorator
@@ -0,0 +1,238 @@
+import dataclasses
+import json
+import logging
+import mimetypes
+import os
+import re
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+from PIL import Image
+
+from . import config, imagetools
+
+IMAGE_SUFFIXES = frozenset(
+    ext
+    for ext, mime_type in mimetypes.types_map.items()
+    if mime_type in ("image/jpeg", "image/png")
+)
+MIN_FILE_SIZE = 1024
+MAX_FILE_SIZE = 10 * 1024 * 1024
+
+# valid filenames are dkp_id-index.ext | dkp_id-m.ext | dkp_id.ext
+FILENAME_PATTERN = re.compile(r"^(\d+)(?:-([mM]|\d+))?$")
+
+# longest side the white border check decodes an image at
+BORDER_CHECK_SIDE = 500
+
+
+@dataclass(slots=True, frozen=True)
+class ImageRecord:
+    """Everything later stages need to know about a source image."""
+
+    path: Path
+    dkp_id: str
+    index: int | None
+    is_main: bool
+    size: int
+    width: int
+    height: int
+    mode: str
+    format: str | None
+    # whether the border is white, checked only for images not roughly square
+    white_border: bool | None = None
+
+
+def has_white_border(path: Path) -> bool:
+    with Image.open(path) as source:
+        source.draft(None, (BORDER_CHECK_SIDE, BORDER_CHECK_SIDE))
+        return imagetools.has_white_border(source, max_side=BORDER_CHECK_SIDE)
+
+
+def scan_file(path: Path, stat: os.stat_result) -> ImageRecord | None:
+    """
+    Build the record of an upload candidate, or None if it is not one.
+    Only the image header is parsed; the pixels are decoded, as a reduced
+    draft, only to check the border of an image that is not roughly square.
+    """
+    if path.suffix.lower() not in IMAGE_SUFFIXES:
+        return None
+
+    if not MIN_FILE_SIZE <= stat.st_size <= MAX_FILE_SIZE:
+        return None
+
+    match = FILENAME_PATTERN.match(path.stem)
+    if not match:
+        return None
+
+    try:
+        with Image.open(path) as image:
+            width, height = image.size
+            mode, format = image.mode, image.format
+    except Exception:
+        return None
+
+    white_border = None
+    if config.validate_border and not imagetools.is_aspect_ratio_valid((width, height)):
+        try:
+            white_border = has_white_border(path)
+        except Exception:
+            white_border = False
+
+    dkp_id, index = match.groups()
+    is_main = index is not None and index.lower() == "m"
+    return ImageRecord(
+        path=path,
+        dkp_id=dkp_id,
+        index=int(index) if index and not is_main else None,
+        is_main=is_main,
+        size=stat.st_size,
+        width=width,
+        height=height,
+        mode=mode,
+        format=format,
+        white_border=white_border,
+    )
+
+
+def _record_to_json(record: ImageRecord | None) -> dict | None:
+    if record is None:
+        return None
+    return {**dataclasses.asdict(record), "path": str(record.path)}
+
+
+def _record_from_json(data: dict | None) -> ImageRecord | None:
+    if data is None:
+        return None
+    return ImageRecord(**{**data, "path": Path(data["path"])})
+
+
+class ScanIndex:
+    """
+    On-disk manifest of content_dir. For every directory it keeps the
+    directory mtime, its subdirectories and, for files inside `not uploaded`
+    trees, each file's (mtime, size) and scan result, white border check
+    included.
+
+    A directory whose mtime is unchanged is not listed again, and a file whose
+    (mtime, size) is unchanged is not reopened, so a rescan costs one stat per
+    directory plus the work for whatever actually changed.
+    """
+
+    version = 2
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.dirs: dict[str, dict] = {}
+        self.load()
+
+    def load(self):
+        if not self.path.exists():
+            return
+
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            logging.warning(f"Ignoring unreadable scan index {self.path}")
+            return
+
+        if data.get("version") == self.version:
+            self.dirs = data.get("dirs", {})
+
+    def save(self):
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": self.version, "dirs": self.dirs}, f)
+        os.replace(tmp_path, self.path)
+
+    def _scan_directory(self, directory: Path, in_scope: bool, started: float):
+        stat = directory.stat()
+        cached = self.dirs.get(str(directory))
+        if cached and cached["mtime_ns"] == stat.st_mtime_ns:
+            return cached
+
+        cached_files = cached["files"] if cached else {}
+        subdirs, files = [], {}
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    subdirs.append(entry.name)
+                    continue
+
+                if not in_scope or not entry.is_file():
+                    continue
+
+                entry_stat = entry.stat()
+                key = [entry_stat.st_mtime_ns, entry_stat.st_size]
+                file = cached_files.get(entry.name)
+                if not file or file["key"] != key:
+                    record = scan_file(Path(entry.path), entry_stat)
+                    file = {"key": key, "record": _record_to_json(record)}
+                files[entry.name] = file
+
+        # a directory changed within the mtime granularity of this scan may
+        # change again unnoticed, so it is only trusted from the next scan on
+        recent = stat.st_mtime_ns >= (started - 2) * 1e9
+        return {
+            "mtime_ns": -1 if recent else stat.st_mtime_ns,
+            "subdirs": subdirs,
+            "files": files,
+        }
+
+    def scan(self, content_dir: Path, *, rebuild: bool = False) -> list[ImageRecord]:
+        """
+        Rescan `content_dir` and return a record for every upload candidate
+        inside a `not uploaded` directory. `rebuild` discards the manifest.
+        """
+        if rebuild:
+            self.dirs = {}
+
+        started = time.time()
+        dirs: dict[str, dict] = {}
+        records: list[ImageRecord] = []
+        stack = [Path(content_dir)]
+        while stack:
+            directory = stack.pop()
+            in_scope = "not uploaded" in str(directory)
+            try:
+                scanned = self._scan_directory(directory, in_scope, started)
+            except FileNotFoundError:
+                continue
+            dirs[str(directory)] = scanned
+
+            for name in scanned["subdirs"]:
+                # uploaded folders only grow and never hold candidates
+                if name == "uploaded" and not in_scope:
+                    continue
+                stack.append(directory / name)
+
+            for file in scanned["files"].values():
+                record = _record_from_json(file["record"])
+                if record:
+                    records.append(record)
+
+        self.dirs = dirs
+        self.save()
+        return records
+
+
+def scan_not_uploaded(content_dir: Path, *, rebuild: bool = False) -> list[ImageRecord]:
+    """Incrementally scan `content_dir` using the index under tmp_dir."""
+    index = ScanIndex(config.tmp_dir / "scan_index.json")
+    return index.scan(content_dir, rebuild=rebuild)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Scan the content directory")
+    parser.add_argument(
+        "--rebuild", action="store_true", help="discard the index and rescan all"
+    )
+    args = parser.parse_args()
+
+    config.config_logger()
+    images = scan_not_uploaded(config.content_dir, rebuild=args.rebuild)
+    logging.info(f"Found {len(images)} not uploaded images")
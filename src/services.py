@@ -1,54 +1,137 @@
+import heapq
 import json
-import logging
-import os
+import math
 import random
-import shutil
 import string
 from pathlib import Path
 
 from persiantools.jdatetime import JalaliDate
 from PIL import Image
 
-from . import config, imagetools
+from . import config, imagetools, normalize, scanner
+from .scanner import ImageRecord
 
 
-def is_valid(image: Path | str | Image.Image | None) -> bool:
+def is_valid(image: ImageRecord | Path | str | Image.Image | None) -> bool:
     if image is None:
         return False
 
     if isinstance(image, str | Path):
         image = Image.open(image)
 
-    width, height = image.size
+    if isinstance(image, ImageRecord):
+        width, height = image.width, image.height
+    else:
+        width, height = image.size
     max_side = max(width, height)
     if max_side < 600:
         return False
 
-    return True
-    if not imagetools.is_aspect_ratio_valid(image):
-        if not imagetools.has_white_border(image):
+    if not config.validate_border:
+        return True
+
+    if not imagetools.is_aspect_ratio_valid((width, height)):
+        if isinstance(image, ImageRecord):
+            # checked by the scan, unless border validation was off back then
+            if image.white_border is None:
+                return scanner.has_white_border(image.path)
+            return image.white_border
+        if not imagetools.has_white_border(image, max_side=scanner.BORDER_CHECK_SIDE):
             return False
     return True
 
 
-def create_upload_dicts(images: list[Path], key: str = "") -> list[dict[str, str]]:
-    accepted_images: list[dict[str, str]] = []
-    for image_path in images:
-        if not is_valid(image_path):
+def allocate_batches(
+    groups: dict[str, list[tuple[str, int]]],
+    max_count: int = 100,
+    max_bytes: int | None = None,
+) -> list[dict[str, str]]:
+    """
+    Spread the `(path, estimated_size)` images of each dkp_id over as few
+    batches as possible, with at most `max_count` entries, one entry per
+    dkp_id and at most `max_bytes` estimated bytes in a batch. An image larger
+    than `max_bytes` gets a batch of its own.
+
+    It starts from the lower bound of max(largest group, ceil(images /
+    max_count), ceil(bytes / max_bytes)) batches and deals the images out
+    round-robin, one group after the other: a group never wraps onto a batch
+    it already used and the batches fill evenly. Only when the byte budget
+    makes the next batch unusable does it fall back to the batch with the
+    most room left, taken from a heap of the batches that are not full, and
+    a new batch is opened if none fits.
+    """
+    images = [image for paths in groups.values() for image in paths]
+    if not images:
+        return []
+
+    total_bytes = sum(size for _, size in images)
+    batch_count = max(
+        max(len(paths) for paths in groups.values()),
+        math.ceil(len(images) / max_count),
+        math.ceil(total_bytes / max_bytes) if max_bytes else 1,
+    )
+    batches: list[dict[str, str]] = [{} for _ in range(batch_count)]
+    batch_bytes = [0] * batch_count
+    # (bytes, index) of the batches that are not full, entries whose bytes
+    # are out of date are dropped when they come up
+    free = [(0, i) for i in range(batch_count)]
+
+    def fits(i: int, dkp_id: str, size: int) -> bool:
+        if dkp_id in batches[i] or len(batches[i]) >= max_count:
+            return False
+        if not batches[i] or max_bytes is None:
+            return True
+        return batch_bytes[i] + size <= max_bytes
+
+    def least_full(dkp_id: str, size: int) -> int | None:
+        # the batches skipped for holding dkp_id are at most its group size
+        skipped, found = [], None
+        while free:
+            used, j = free[0]
+            if used != batch_bytes[j] or len(batches[j]) >= max_count:
+                heapq.heappop(free)
+            elif dkp_id in batches[j]:
+                skipped.append(heapq.heappop(free))
+            else:
+                if fits(j, dkp_id, size):
+                    found = j
+                break
+        for entry in skipped:
+            heapq.heappush(free, entry)
+        return found
+
+    cursor = 0
+    for dkp_id, paths in groups.items():
+        for path, size in paths:
+            i = cursor
+            if not fits(i, dkp_id, size):
+                i = least_full(dkp_id, size)
+            if i is None:
+                i = len(batches)
+                batches.append({})
+                batch_bytes.append(0)
+
+            batches[i][dkp_id] = path
+            batch_bytes[i] += size
+            if len(batches[i]) < max_count:
+                heapq.heappush(free, (batch_bytes[i], i))
+            cursor = (i + 1) % len(batches)
+
+    return [batch for batch in batches if batch]
+
+
+def create_upload_dicts(
+    images: list[ImageRecord], key: str = ""
+) -> list[dict[str, str]]:
+    groups: dict[str, list[tuple[str, int]]] = {}
+    for image in images:
+        if not is_valid(image):
             continue
 
-        dkp_id = image_path.stem.split("-")[0]
+        size = normalize.estimate_output_size(image)
+        groups.setdefault(image.dkp_id, []).append((str(image.path), size))
 
-        i = 0
-
-        while i < len(accepted_images):
-            if len(accepted_images[i]) < 100 and accepted_images[i].get(dkp_id) is None:
-                break
-            i += 1
-        else:
-            accepted_images.append({})
-
-        accepted_images[i][dkp_id] = str(image_path)
+    accepted_images = allocate_batches(groups, max_bytes=config.max_zip_bytes)
 
     (config.tmp_dir / key).mkdir(parents=True, exist_ok=True)
     with open(config.tmp_dir / key / f"dicts_{key}.json", "w", encoding="utf-8") as f:
@@ -58,42 +141,15 @@ def create_upload_dicts(images: list[Path], key: str = "") -> list[dict[str, str
 
 
 def create_zips(dicts: list[dict[str, str]], key: str = ""):
-    import zipfile
-    zips = []
     basedir = config.tmp_dir / key
-    for i, d in enumerate(dicts):
-        # download all images from d.values
-        # save with name of f'{d.keys}.jpg'
-        # zip all of them
-        for k, v in d.items():
-            image = Image.open(v)
-
-            width, height = image.size
-            aspect_ratio = imagetools.get_aspect_ratio_str(width, height)
-            if aspect_ratio != "1:1":
-                # add white pixels to image to achieve 1:1 aspect ratio
-                image = imagetools.square_pad_white_pixels(image)
-                logging.warning(f"Aspect ratio {aspect_ratio} {k} {v}")
-            if image.size[0] > 2500:
-                image = imagetools.resize_image(image, 2500)
-
-            image_bytes = imagetools.convert_image_bytes(image, "JPEG")
-            image_bytes.seek(0)
-            (basedir / f"{i}").mkdir(parents=True, exist_ok=True)
-            with open(basedir / f"{i}" / f"{k}.jpg", "wb") as f:
-                f.write(image_bytes.getvalue())
-
-        # zip all of them
-        with zipfile.ZipFile(basedir / f"zip_{key}_{i + 1}.zip", "w") as zipf:
-            for k in d.keys():
-                zipf.write(basedir / f"{i}" / f"{k}.jpg", f"{k}.jpg")
-
-        # delete tmp files
-        shutil.rmtree(basedir / f"{i}")
-
-        zips.append(basedir / f"zip_{key}_{i + 1}.zip")
-
-    return zips
+    basedir.mkdir(parents=True, exist_ok=True)
+    zips = [basedir / f"zip_{key}_{i + 1}.zip" for i in range(len(dicts))]
+    options = normalize.NormalizeOptions(
+        cache_dir=config.image_cache_dir,
+        cache_max_bytes=config.image_cache_bytes,
+        strip_metadata=config.strip_metadata,
+    )
+    return normalize.write_zips(dicts, zips, config.workers, options)
 
 
 def write_excel_openpyxl(excel: list[dict[str, str]], file_path: str):
@@ -184,7 +240,7 @@ def create_excels(dicts: list[dict[str, str]], key: str = ""):
     return excels
 
 
-def create_upload_files(images: list[Path]):
+def create_upload_files(images: list[ImageRecord]):
     key = (
         JalaliDate.today().strftime("%Y-%m-%d")
         + "_"
@@ -198,25 +254,7 @@ def create_upload_files(images: list[Path]):
     return key, dicts, zips, excels
 
 
-def get_not_uploaded_images(content_dir: Path = Path("content")) -> list[Path]:
-    images: list[Path] = []
-    for root, _, files in os.walk(content_dir):
-        # Check if we're in a not_uploaded directory
-        if "not uploaded" not in root:
-            continue
-
-        # Create uploaded directory if it doesn't exist
-        uploaded_dir = Path(root).with_name("uploaded")
-        uploaded_dir.mkdir(parents=True, exist_ok=True)
-
-        # Process each file in the not_uploaded directory
-        for file in files:
-            file_path = Path(root) / file
-
-            # Check if the file is an image
-            if not imagetools.is_image_file(file_path):
-                continue
-
-            images.append(file_path)
-
-    return images
+def get_not_uploaded_images(
+    content_dir: Path = Path("content"), *, rebuild: bool = False
+) -> list[ImageRecord]:
+    return scanner.scan_not_uploaded(content_dir, rebuild=rebuild)
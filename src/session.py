@@ -0,0 +1,51 @@
+import time
+
+import httpx
+
+from . import config, ratelimit
+from .login import AuthenticatedClient
+
+
+class UploaderSession(AuthenticatedClient):
+    """
+    The one async client every uploader step of a run goes through. It keeps
+    a keep-alive connection pool, so each step reuses an open TCP+TLS (and
+    SOCKS) connection instead of handshaking again, and holds the login
+    cookies and proxy settings; logins go through the same pool.
+
+    Every admin request of the session goes through one rate limiter, so
+    concurrent uploads and pollers together stay within the admin's limits.
+    """
+
+    host = "admin.digikala.com"
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault(
+            "limits",
+            httpx.Limits(
+                max_connections=config.http_max_connections,
+                max_keepalive_connections=config.http_max_keepalive_connections,
+                keepalive_expiry=config.http_keepalive_expiry,
+            ),
+        )
+        kwargs.setdefault(
+            "timeout",
+            httpx.Timeout(config.http_timeout, connect=config.http_connect_timeout),
+        )
+        super().__init__(**kwargs)
+        self.limiter = ratelimit.RateLimiter()
+
+    async def send(self, request: httpx.Request, **kwargs) -> httpx.Response:
+        if request.url.host != self.host:
+            return await super().send(request, **kwargs)
+
+        bucket = self.limiter.bucket(request)
+        await bucket.acquire()
+        started = time.monotonic()
+        try:
+            response = await super().send(request, **kwargs)
+        except httpx.TimeoutException:
+            self.limiter.feedback(bucket, None, time.monotonic() - started)
+            raise
+        self.limiter.feedback(bucket, response, time.monotonic() - started)
+        return response
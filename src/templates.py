@@ -0,0 +1,74 @@
+import logging
+import weakref
+from collections.abc import Awaitable, Callable
+
+import httpx
+
+from . import config, metrics
+
+# (exported_file, upload_id) of an exported excel template
+Template = tuple[str, str]
+
+
+class TemplatePool:
+    """
+    Excel templates exported in one session, for reuse by later batches.
+
+    Every batch gets the same `auto_assign_products_photo` template, so a
+    batch takes a template another batch has finished importing with instead
+    of exporting a new one, saving the export POST and its redirect GET. A
+    template is only handed out again once released, after its import is
+    Imported, so concurrent imports never share an item; with N batches in
+    flight at most N templates are exported per session. If the server
+    refuses an import into a reused template, every later batch exports its
+    own again.
+
+    Reuse is off unless `upload_reuse_templates` is set. A reused template
+    comes with the id its last import was Imported as, since its row may
+    still show that import until the new one starts.
+    """
+
+    def __init__(self, export: Callable[[str, httpx.AsyncClient], Awaitable[Template]]):
+        self.export = export
+        # cleared once the server refuses an import into a reused template
+        self.reuse = config.upload_reuse_templates
+        # released templates with the id of their last import
+        self._free: list[tuple[Template, str]] = []
+
+    async def acquire(
+        self, title: str, client: httpx.AsyncClient
+    ) -> tuple[Template, str | None]:
+        """Return a template and, if it is a reused one, its last import id."""
+        if self.reuse and self._free:
+            metrics.increment("templates.reused")
+            return self._free.pop()
+
+        metrics.increment("templates.exported")
+        return await self.export(title, client), None
+
+    async def replace(
+        self, template: Template, title: str, client: httpx.AsyncClient
+    ) -> Template:
+        """Export a new template in place of one the server refused to reuse."""
+        logging.warning(f"Excel template {template[1]} can not be reused")
+        metrics.increment("templates.refused")
+        self.reuse = False
+        self._free.clear()
+        return await self.export(title, client)
+
+    def release(self, template: Template, imported_id: str):
+        if self.reuse:
+            self._free.append((template, imported_id))
+
+
+_pools: weakref.WeakKeyDictionary[httpx.AsyncClient, TemplatePool] = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def get_pool(
+    client: httpx.AsyncClient,
+    export: Callable[[str, httpx.AsyncClient], Awaitable[Template]],
+) -> TemplatePool:
+    """Return the template pool of this client, creating it on first use."""
+    return _pools.setdefault(client, TemplatePool(export))
@@ -0,0 +1,132 @@
+import logging
+import os
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO
+
+import httpx
+
+from . import metrics
+
+# uploads at least this large log their progress every PROGRESS_STEP
+PROGRESS_MIN_SIZE = 32 * 1024 * 1024
+PROGRESS_STEP = 0.1
+
+
+@dataclass(slots=True)
+class TransferStats:
+    """
+    Timings of one upload, all `time.perf_counter()` values. The body is sent
+    from `started`, the first read of the file, until `last_read`, so time
+    spent queued for a connection or by the rate limiter is left out. `ttfb`
+    runs from `started` until the response headers arrived, so it includes
+    the server's processing time.
+    """
+
+    name: str
+    total: int
+    sent: int = 0
+    started: float | None = None
+    last_read: float | None = None
+    response_at: float | None = None
+
+    @property
+    def send_time(self) -> float:
+        if self.started is None or self.last_read is None:
+            return 0
+        return self.last_read - self.started
+
+    @property
+    def rate(self) -> float:
+        """Bytes sent per second."""
+        return self.sent / self.send_time if self.send_time else 0
+
+    @property
+    def ttfb(self) -> float:
+        if self.started is None or self.response_at is None:
+            return 0
+        return self.response_at - self.started
+
+    def record(self, label: str):
+        metrics.increment(f"upload.{label}.bytes", self.sent)
+        metrics.observe(f"upload.{label}.bytes_per_second", self.rate)
+        metrics.observe(f"upload.{label}.ttfb", self.ttfb)
+        logging.info(
+            f"Uploaded {self.name}: {self.sent / 2**20:.1f} MiB in "
+            f"{self.send_time:.1f}s ({self.rate / 2**20:.2f} MiB/s), "
+            f"ttfb {self.ttfb:.1f}s"
+        )
+
+
+class CountingFile:
+    """
+    Read-only file wrapper handed to the multipart encoder, which reads it in
+    64 KiB chunks. Counts the bytes read into `stats` and logs the progress
+    of large uploads.
+    """
+
+    def __init__(self, fp: BinaryIO, stats: TransferStats):
+        self._fp = fp
+        self._stats = stats
+        self._next_progress = PROGRESS_STEP
+
+    def read(self, size: int = -1) -> bytes:
+        stats = self._stats
+        if stats.started is None:
+            stats.started = time.perf_counter()
+        chunk = self._fp.read(size)
+        stats.sent += len(chunk)
+        stats.last_read = time.perf_counter()
+        if stats.total >= PROGRESS_MIN_SIZE and stats.sent >= (
+            self._next_progress * stats.total
+        ):
+            logging.info(
+                f"Uploading {stats.name}: {stats.sent / stats.total:.0%} "
+                f"({stats.rate / 2**20:.2f} MiB/s)"
+            )
+            self._next_progress += PROGRESS_STEP
+        return chunk
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        position = self._fp.seek(offset, whence)
+        if position == 0:
+            # the body is being rendered, again after a replayed request
+            self._stats.sent = 0
+            self._stats.started = self._stats.last_read = None
+            self._next_progress = PROGRESS_STEP
+        return position
+
+    def tell(self) -> int:
+        return self._fp.tell()
+
+    def fileno(self) -> int:
+        return self._fp.fileno()
+
+
+async def post_file(
+    client: httpx.AsyncClient,
+    url: str,
+    path: Path,
+    *,
+    field_name: str,
+    content_type: str,
+    label: str,
+    **kwargs,
+) -> httpx.Response:
+    """
+    POST `path` as the multipart file field `field_name`, streamed from disk
+    so memory stays bounded whatever its size. The file is always closed, and
+    the bytes sent, send rate and time to the response headers are logged
+    and recorded as `upload.<label>.*` metrics. The response body is read
+    before returning.
+    """
+    with open(path, "rb") as fp:
+        stats = TransferStats(path.name, os.fstat(fp.fileno()).st_size)
+        files = {field_name: (path.name, CountingFile(fp, stats), content_type)}
+        async with client.stream("POST", url, files=files, **kwargs) as response:
+            stats.response_at = time.perf_counter()
+            await response.aread()
+
+    stats.record(label)
+    return response
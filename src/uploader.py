@@ -1,26 +1,38 @@
 import asyncio
 import json
 import logging
-import os
 import re
 import shutil
 from pathlib import Path
 
 import httpx
-import pandas as pd
-from bs4 import BeautifulSoup
 
-from . import basic, config
+from . import (
+    config,
+    htmlparse,
+    journal,
+    logcontext,
+    login,
+    metrics,
+    mover,
+    poller,
+    report,
+    retry,
+    templates,
+    transfer,
+)
 from .login import AuthenticatedClient
+from .session import UploaderSession
 
+ZIP_TABLE_URL = "https://admin.digikala.com/auto/assign/product/photo/file/"
+EXCEL_TABLE_URL = "https://admin.digikala.com/excel-imports/"
 
-async def upload_zip(filepath: Path, cookies: dict | httpx.Cookies | None = None):
+
+@retry.retrying("upload_zip")
+async def upload_zip(filepath: Path, client: httpx.AsyncClient):
     url = "https://admin.digikala.com/auto/assign/product/photo/file/item/0/"
     params = {"_back": "https://admin.digikala.com/auto/assign/product/photo/file/"}
 
-    # Prepare the multipart form data
-    files = {"files[]": (filepath.name, open(filepath, "rb"), "application/zip")}
-
     data = {
         "name": "file",
         "namespace": "444",
@@ -37,22 +49,25 @@ async def upload_zip(filepath: Path, cookies: dict | httpx.Cookies | None = None
         "Referer": url + "?" + "_back=" + params["_back"],
     }
 
-    async with httpx.AsyncClient(proxy=os.getenv("DIGIKALA_PROXY")) as client:
-        response = await client.post(
-            url,
-            params=params,
-            files=files,
-            data=data,
-            headers=headers,
-            cookies=cookies,
-            timeout=60,
-        )
+    response = await transfer.post_file(
+        client,
+        url,
+        filepath,
+        field_name="files[]",
+        content_type="application/zip",
+        label="zip",
+        params=params,
+        data=data,
+        headers=headers,
+    )
+    retry.raise_for_server_error(response)
 
     return response.json()
 
 
+@retry.retrying("submit_zip", idempotent=False)
 async def submit_uploaded_file(
-    upload_response: dict, name: str, cookies: dict | httpx.Cookies | None = None
+    upload_response: dict, name: str, client: httpx.AsyncClient
 ):
     url = "https://admin.digikala.com/auto/assign/product/photo/file/item/0/"
     params = {"_back": "https://admin.digikala.com/auto/assign/product/photo/file/"}
@@ -83,89 +98,80 @@ async def submit_uploaded_file(
         "Upgrade-Insecure-Requests": "1",
     }
 
-    async with httpx.AsyncClient(proxy=os.getenv("DIGIKALA_PROXY")) as client:
-        response = await client.post(
-            url,
-            params=params,
-            data=data,
-            headers=headers,
-            cookies=cookies,
-            timeout=60,
-        )
+    response = await client.post(
+        url,
+        params=params,
+        data=data,
+        headers=headers,
+    )
+    retry.raise_for_server_error(response)
 
     return response
 
 
-async def check_zip_upload_table_status(
-    name: str, cookies: dict | httpx.Cookies | None = None
-):
-    url = "https://admin.digikala.com/auto/assign/product/photo/file/"
-
-    async with httpx.AsyncClient(proxy=os.getenv("DIGIKALA_PROXY")) as client:
-        response = await client.get(
-            url,
-            headers={"Origin": "https://admin.digikala.com"},
-            cookies=cookies,
-            timeout=60,
-        )
-
-    soup = BeautifulSoup(response.text, "html.parser")
-    table_form = soup.find(id="tableForm")
-
-    if not table_form:
-        return None
-
-    table = table_form.find("table")
-    if not table:
-        return None
-
-    rows = table.find_all("tr")
-    for row in rows:
-        cells = row.find_all("td")
-        if not cells:
-            continue
-
-        if cells[0].text.strip() != name:
-            continue
+def zip_table_rows(html: str) -> dict[str, list[str]]:
+    return htmlparse.table_rows(html, 0)
 
-        if cells[3].text.strip() == "Done":
-            return True
-        return False
 
-    return None
+def zip_row_status(cells: list[str]) -> bool:
+    return cells[3] == "Done"
 
 
-async def check_zip_upload_status(
-    name: str, cookies: dict | httpx.Cookies | None = None
-):
-    for _ in range(100):
-        upload_response = await check_zip_upload_table_status(name, cookies)
-        if upload_response is None:
-            return None
-
-        if upload_response:
-            return upload_response
+async def check_zip_upload_table_status(name: str, client: httpx.AsyncClient):
+    response = await client.get(
+        ZIP_TABLE_URL,
+        headers={"Origin": "https://admin.digikala.com"},
+    )
 
-        await asyncio.sleep(5)
+    cells = zip_table_rows(response.text).get(name)
+    if not cells:
+        return None
+    return zip_row_status(cells)
 
 
-@basic.retry_execution(attempts=3, delay=1)
-async def process_zip_import(
-    filepath: Path, cookies: dict | httpx.Cookies | None = None
-):
-    upload_response_data = await upload_zip(filepath, cookies)
-    logging.debug(f"Zip upload response: {upload_response_data}")
-    submit_response = await submit_uploaded_file(
-        upload_response_data, filepath.stem, cookies
+async def check_zip_upload_status(name: str, client: httpx.AsyncClient):
+    """Wait for the zip import to be Done, polling its table with other jobs"""
+    table = poller.get_poller(
+        client, ZIP_TABLE_URL, zip_table_rows, zip_row_status, label="zip_import"
     )
-    logging.debug(f"Zip submit response: {submit_response.status_code}")
-    await check_zip_upload_status(filepath.stem, cookies)
-    return submit_response
+    return await table.wait(name)
 
 
-async def export_excel_template(
-    title: str, cookies: dict | httpx.Cookies | None = None
-):
+async def process_zip_import(
+    filepath: Path, client: httpx.AsyncClient, batch: journal.BatchJournal
+) -> int:
+    """
+    Upload, submit and wait for the zip, skipping the steps `batch` already
+    completed, so a retry never uploads the zip again. Returns the status
+    code of the submit.
+    """
+    if not batch.done("zip_uploaded"):
+        upload_response_data = await upload_zip(filepath, client)
+        logging.debug(f"Zip upload response: {upload_response_data}")
+        batch.record("zip_uploaded", upload_response_data)
+
+    if not batch.done("zip_submitted"):
+        submit_response = await submit_uploaded_file(
+            batch.get("zip_uploaded"), filepath.stem, client
+        )
+        logging.debug(f"Zip submit response: {submit_response.status_code}")
+        batch.record("zip_submitted", submit_response.status_code)
+
+    if not batch.done("zip_done"):
+        try:
+            zip_done = await check_zip_upload_status(filepath.stem, client)
+        except poller.PollTimeoutError as e:
+            # the excel must not be imported before its photos, the batch
+            # waits for the zip again when it is resumed
+            raise Exception(f"Zip import timed out: {e}") from e
+        if not zip_done:
+            raise Exception("Zip import not found in the imports table")
+        batch.record("zip_done", zip_done)
+    return batch.get("zip_submitted")
+
+
+@retry.retrying("export_template")
+async def export_excel_template(title: str, client: httpx.AsyncClient):
     """Step 1: Export the excel template and get the exported file info"""
     # Initial export request
     url = "https://admin.digikala.com/excel-imports/item/0/"
@@ -190,57 +196,43 @@ async def export_excel_template(
     }
 
     # Make initial request
-    async with httpx.AsyncClient(proxy=os.getenv("DIGIKALA_PROXY")) as client:
-        export_response = await client.post(
-            url,
-            params=params,
-            data=data,
-            headers=headers,
-            cookies=cookies,
-            timeout=60,
-        )
+    export_response = await client.post(
+        url,
+        params=params,
+        data=data,
+        headers=headers,
+    )
+    retry.raise_for_server_error(export_response)
 
     # Extract redirect URL from response
-    soup = BeautifulSoup(export_response.text, "html.parser")
-    redirect_url = soup.find("a")["href"]
+    redirect_url = htmlparse.first_link_href(export_response.text)
     if not redirect_url:
         raise Exception("Failed to get redirect URL from export response")
 
     # Follow redirect to get the exported file info
     full_redirect_url = f"https://admin.digikala.com{redirect_url}"
-    async with httpx.AsyncClient(proxy=os.getenv("DIGIKALA_PROXY")) as client:
-        redirect_response = await client.get(
-            full_redirect_url,
-            cookies=cookies,
-            timeout=60,
-        )
+    redirect_response = await client.get(
+        full_redirect_url,
+    )
+    retry.raise_for_server_error(redirect_response)
 
     # Parse the response to get the exported file info
-    soup = BeautifulSoup(redirect_response.text, "html.parser")
     # Look for the exported file info in a hidden input or form field
-    exported_file_field = soup.find("input", {"name": "exported_file"})
-    if not exported_file_field:
+    exported_file = htmlparse.input_value(redirect_response.text, "exported_file")
+    if exported_file is None:
         raise Exception("Could not find exported file info in response")
 
-    return exported_file_field["value"], redirect_url.split("/")[3]
+    return exported_file, redirect_url.split("/")[3]
 
 
+@retry.retrying("upload_excel")
 async def upload_excel_file(
-    title: str, excel_filepath: Path, cookies: dict | httpx.Cookies | None = None
+    title: str, excel_filepath: Path, upload_id: str, client: httpx.AsyncClient
 ):
     """Step 2: Upload the excel file and get the imported file info"""
-    url = "https://admin.digikala.com/excel-imports/item/154298/"
+    url = f"https://admin.digikala.com/excel-imports/item/{upload_id}/"
     params = {"_back": "https://admin.digikala.com/excel-imports/"}
 
-    # Create form data with file
-    files = {
-        "files[]": (
-            excel_filepath.name,
-            open(excel_filepath, "rb"),
-            "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        )
-    }
-
     data = {
         "name": "imported_file",
         "namespace": "60",
@@ -261,18 +253,20 @@ async def upload_excel_file(
     }
 
     # Upload the file
-    async with httpx.AsyncClient(proxy=os.getenv("DIGIKALA_PROXY")) as client:
-        response = await client.post(
-            url,
-            params=params,
-            data=data,
-            files=files,
-            headers=headers,
-            cookies=cookies,
-            timeout=60,
-        )
+    response = await transfer.post_file(
+        client,
+        url,
+        excel_filepath,
+        field_name="files[]",
+        content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        label="excel",
+        params=params,
+        data=data,
+        headers=headers,
+    )
 
     # Parse JSON response
+    retry.raise_for_server_error(response)
     if response.status_code != 200:
         raise Exception(f"File upload failed with status {response.status_code}")
 
@@ -283,12 +277,13 @@ async def upload_excel_file(
     return response_data
 
 
+@retry.retrying("import_excel", idempotent=False)
 async def import_excel_file(
     title: str,
     exported_file_info: str,
     imported_file_info: dict,
     upload_id: str,
-    cookies: dict | httpx.Cookies | None = None,
+    client: httpx.AsyncClient,
 ):
     """Step 3: Import the uploaded excel file"""
     url = f"https://admin.digikala.com/excel-imports/item/{upload_id}/"
@@ -374,106 +369,125 @@ async def import_excel_file(
         "Upgrade-Insecure-Requests": "1",
     }
 
-    async with httpx.AsyncClient(proxy=os.getenv("DIGIKALA_PROXY")) as client:
-        response = await client.post(
-            url,
-            params=params,
-            data=data,
-            headers=headers,
-            cookies=cookies,
-            timeout=60,
-        )
+    response = await client.post(
+        url,
+        params=params,
+        data=data,
+        headers=headers,
+    )
+    retry.raise_for_server_error(response)
 
     return response
 
 
-async def check_excel_upload_table_status(
-    name: str, cookies: dict | httpx.Cookies | None = None
-):
-    """Check the status of an excel import in the table"""
-    url = "https://admin.digikala.com/excel-imports/"
-
-    async with httpx.AsyncClient(proxy=os.getenv("DIGIKALA_PROXY")) as client:
-        response = await client.get(
-            url,
-            headers={"Origin": "https://admin.digikala.com"},
-            cookies=cookies,
-            timeout=60,
-        )
-    soup = BeautifulSoup(response.text, "html.parser")
-    table_form = soup.find(id="tableForm")
+def excel_table_rows(html: str) -> dict[str, list[str]]:
+    return htmlparse.table_rows(html, 2)
 
-    if not table_form:
-        return None
-
-    table = table_form.find("table")
-    if not table:
-        return None
 
-    rows = table.find_all("tr")
-    for row in rows:
-        cells = row.find_all("td")
-        if not cells:
-            continue
+def excel_row_status(cells: list[str]) -> str | bool:
+    if cells[5] == "Imported":
+        return cells[1]
 
-        if cells[2].text.strip() != name:
-            continue
+    if cells[5] == "Invalid":
+        logging.warning(f"Invalid excel file {cells[2]}")
+        raise retry.PermanentError("Invalid excel file upload")
 
-        if cells[5].text.strip() == "Imported":
-            return cells[1].text.strip()
+    return False
 
-        if cells[5].text.strip() == "Invalid":
-            logging.warning(f"Invalid excel file {name}")
-            raise Exception("Invalid excel file upload")
 
-        return False
+async def check_excel_upload_table_status(name: str, client: httpx.AsyncClient):
+    """Check the status of an excel import in the table"""
+    response = await client.get(
+        EXCEL_TABLE_URL,
+        headers={"Origin": "https://admin.digikala.com"},
+    )
 
-    return None
+    cells = excel_table_rows(response.text).get(name)
+    if not cells:
+        return None
+    return excel_row_status(cells)
 
 
 async def check_excel_upload_status(
-    name: str, cookies: dict | httpx.Cookies | None = None
+    name: str, client: httpx.AsyncClient, *, previous: str | None = None
 ):
-    """Poll the excel import status until complete"""
-    for _ in range(100):
-        upload_response = await check_excel_upload_table_status(name, cookies)
-        if upload_response is None:
-            return None
-
-        if upload_response:
-            return upload_response
-
-        await asyncio.sleep(5)
+    """
+    Wait for the excel import to complete, polling its table with other
+    jobs. `previous` is the id a reused template was last Imported as, which
+    only counts once the row went through another status.
+    """
+    table = poller.get_poller(
+        client,
+        EXCEL_TABLE_URL,
+        excel_table_rows,
+        excel_row_status,
+        label="excel_import",
+    )
+    return await table.wait(name, previous=previous)
 
 
 async def process_excel_import(
-    title: str, excel_filepath: Path, cookies: dict | httpx.Cookies | None = None
+    title: str,
+    excel_filepath: Path,
+    client: httpx.AsyncClient,
+    batch: journal.BatchJournal,
 ) -> str:
-    """Handle the complete excel import process"""
-    # Step 1: Export template and get exported file info
-    exported_file_info, upload_id = await export_excel_template(title, cookies)
-    if not exported_file_info:
-        raise Exception("Failed to get exported file info")
+    """Handle the complete excel import process, resuming after `batch` steps"""
+    pool = templates.get_pool(client, export_excel_template)
+
+    # Step 1: Take an exported template, reusing one of this session if free
+    if not batch.done("template_exported"):
+        (exported_file_info, upload_id), previous = await pool.acquire(title, client)
+        if not exported_file_info:
+            raise Exception("Failed to get exported file info")
+        batch.record("template_exported", [exported_file_info, upload_id, previous])
+    exported_file_info, upload_id, previous = batch.get("template_exported")
 
     # Step 2: Upload excel file and get imported file info
-    imported_file_info = await upload_excel_file(title, excel_filepath, cookies)
-    if not imported_file_info:
-        raise Exception("Failed to get imported file info")
+    if not batch.done("excel_uploaded"):
+        imported_file_info = await upload_excel_file(
+            title, excel_filepath, upload_id, client
+        )
+        if not imported_file_info:
+            raise Exception("Failed to get imported file info")
+        batch.record("excel_uploaded", imported_file_info)
+    imported_file_info = batch.get("excel_uploaded")
 
     # Step 3: Import the uploaded file
-    import_response = await import_excel_file(
-        title, exported_file_info, imported_file_info, upload_id, cookies
-    )
-    if import_response.status_code >= 400:
-        raise Exception(f"Failed to import excel: {import_response.status_code}")
+    if not batch.done("excel_submitted"):
+        import_response = await import_excel_file(
+            title, exported_file_info, imported_file_info, upload_id, client
+        )
+        if import_response.status_code >= 400 and previous is not None:
+            # the server refused a second import into this template
+            exported_file_info, upload_id = await pool.replace(
+                (exported_file_info, upload_id), title, client
+            )
+            previous = None
+            batch.record("template_exported", [exported_file_info, upload_id, None])
+            import_response = await import_excel_file(
+                title, exported_file_info, imported_file_info, upload_id, client
+            )
+        if import_response.status_code >= 400:
+            raise Exception(f"Failed to import excel: {import_response.status_code}")
+        logging.debug(f"Excel import response: {import_response.status_code}")
+        batch.record("excel_submitted", import_response.status_code)
 
-    logging.debug(f"Excel import response: {import_response.status_code}")
     # Step 4: Check import status
-    excel_upload_id = await check_excel_upload_status(title, cookies)
-    if not excel_upload_id:
-        raise Exception("Excel import failed or timed out")
+    if not batch.done("excel_imported"):
+        try:
+            excel_upload_id = await check_excel_upload_status(
+                title, client, previous=previous
+            )
+        except poller.PollTimeoutError as e:
+            raise Exception(f"Excel import timed out: {e}") from e
+        if not excel_upload_id:
+            raise Exception("Excel import not found in the imports table")
+        batch.record("excel_imported", excel_upload_id)
 
-    return excel_upload_id
+    # the import is done, later batches can import into the same template
+    pool.release((exported_file_info, upload_id), batch.get("excel_imported"))
+    return batch.get("excel_imported")
 
 
 async def download_unzip(url: str, filepath: Path):
@@ -488,70 +502,102 @@ async def download_unzip(url: str, filepath: Path):
         zip_ref.extractall(filepath.parent)
 
 
-def check_connection():
-    client = AuthenticatedClient()
-    response = client.get("https://admin.digikala.com", timeout=10)
+async def check_connection():
+    async with AuthenticatedClient(cookies=login.load_cookies()) as client:
+        response = await client.get("https://admin.digikala.com", timeout=10)
     return response.status_code
 
 
-def save_report_excel(*, key: str, uploaded_images: list[str], excel_upload_id: str):
-    # check if report excel exists
-    # load data from report excel
-    # add new records to report excel
-    # data is (original_image_path, status, excel_upload_id, key)
-    # save report excel
-    status = "success" if excel_upload_id else "failed"
-    report_excel_path = config.log_dir / "report.xlsx"
-    new_df = pd.DataFrame(
-        {
-            "key": [key] * len(uploaded_images),
-            "original_image_path": uploaded_images,
-            "image_path": [
-                p.replace("not uploaded", "uploaded") for p in uploaded_images
-            ],
-            "status": [status] * len(uploaded_images),
-            "excel_upload_id": [excel_upload_id] * len(uploaded_images),
-        }
-    )
-    if not report_excel_path.exists():
-        new_df.to_excel(report_excel_path, index=False)
-    else:
-        df = pd.read_excel(report_excel_path)
-        df = pd.concat([df, new_df], ignore_index=True)
-        df.to_excel(report_excel_path, index=False)
-
-    return uploaded_images
-
-
-def post_process(*, key: str, index: int, excel_upload_id: str):
-    basedir = config.tmp_dir / key
-    dicts_path = basedir / f"dicts_{key}.json"
+def load_dicts(key: str) -> list[dict[str, str]] | None:
+    """The `{dkp_id: image_path}` mapping of every batch of `key`."""
+    dicts_path = config.tmp_dir / key / f"dicts_{key}.json"
     if not dicts_path.exists():
         logging.warning(f"dicts_{key}.json not found")
-        return
+        return None
 
     with open(dicts_path, encoding="utf-8") as f:
-        dicts: list[dict[str, str]] = json.load(f)
+        return json.load(f)
+
 
-    uploaded_images: list[str] = list(dicts[index].values())
-    save_report_excel(
+def post_process(
+    *, key: str, index: int, uploaded_images: list[str], excel_upload_id: str
+):
+    """Report the batch's images and move them from not uploaded to uploaded."""
+    report.append(
         key=key, uploaded_images=uploaded_images, excel_upload_id=excel_upload_id
     )
 
-    for image_path in uploaded_images:
-        # move from not uploaded to uploaded
-        src_path = Path(image_path)
-        if not src_path.exists():
-            continue
+    moves = [(p, str(mover.uploaded_path(p))) for p in uploaded_images]
+    log_path = config.tmp_dir / key / f"moves_{index + 1}.json"
+    moved = mover.move_files(moves, log_path)
+    logging.debug(f"Moved {moved}/{len(moves)} images of batch {index + 1}")
 
-        # Get the parent directory and create uploaded directory
-        parent_dir = str(src_path.parent)
-        uploaded_dir = Path(parent_dir.replace("not uploaded", "uploaded"))
-        uploaded_dir.mkdir(parents=True, exist_ok=True)
 
-        # Move the file to uploaded directory
-        dst_path = uploaded_dir / src_path.name
-        shutil.move(str(src_path), str(dst_path))
+def batch_index(zip_path: Path) -> int:
+    """Index of a batch in the key's dicts, from its `zip_<key>_<n>` name."""
+    return int(zip_path.stem.split("_")[-1]) - 1
+
+
+async def process_pair(
+    key: str,
+    zip_path: Path,
+    excel_path: Path,
+    client: httpx.AsyncClient,
+    upload_journal: journal.UploadJournal,
+    dicts: list[dict[str, str]] | None,
+):
+    """
+    Upload one batch: its zip first, then its excel once the zip is Done.
+    Steps already in the journal are skipped, so a batch interrupted by a
+    crash or an error continues where it stopped.
+    """
+    index = batch_index(zip_path)
+    batch = upload_journal.batch(key, index)
+    if batch.done("post_processed"):
+        logging.info(f"{zip_path.stem} already uploaded")
+        return
+    if batch.last_step:
+        logging.info(f"Resuming {zip_path.stem} after {batch.last_step}")
+
+    if not zip_path.exists() or not excel_path.exists():
+        # generate string that which one of zip_path or excel_path,
+        # if both are not found, say both are not found
+        not_found_str = (
+            f"zip_path: {zip_path} not found"
+            if not zip_path.exists()
+            else (
+                f"excel_path: {excel_path} not found"
+                if not excel_path.exists()
+                else "both zip_path and excel_path are not found"
+            )
+        )
+        logging.warning(f"{zip_path.stem} {not_found_str}")
+        return
+
+    # Upload and process zip file
+    zip_status = await process_zip_import(zip_path, client, batch)
+    logging.info(
+        f"Zip upload {zip_path.stem} " + ("OK" if zip_status < 400 else "FAILED")
+    )
+
+    # Process excel file
+    excel_upload_id = await process_excel_import(
+        excel_path.stem, excel_path, client, batch
+    )
+    logging.info(
+        f"Excel import {excel_path.stem} " + ("OK" if excel_upload_id else "FAILED")
+    )
+
+    if dicts is not None:
+        # file moves are slow on network shares, keep them off the event loop
+        await asyncio.to_thread(
+            post_process,
+            key=key,
+            index=index,
+            uploaded_images=list(dicts[index].values()),
+            excel_upload_id=excel_upload_id,
+        )
+    batch.record("post_processed")
 
 
 async def upload_key_dir(key: str):
@@ -559,10 +605,6 @@ async def upload_key_dir(key: str):
     logging.info(f"Uploading key: {key}")
     logging.info("-" * 40)
 
-    client = AuthenticatedClient()
-    response = client.login()
-    cookies = response.cookies
-    
     basedir = config.tmp_dir / key
     zips = sorted(list(basedir.glob("*.zip")))
     excels = list(
@@ -572,48 +614,44 @@ async def upload_key_dir(key: str):
         )
     )
     pairs = list(zip(zips, excels, strict=False))
-
-    for i, (zip_path, excel_path) in enumerate(pairs):
-        logging.info("-" * 40)
-        logging.info(f"Processing file {i + 1}/{len(pairs)}")
-
-        if not zip_path.exists() or not excel_path.exists():
-            # generate string that which one of zip_path or excel_path,
-            # if both are not found, say both are not found
-            not_found_str = (
-                f"zip_path: {zip_path} not found"
-                if not zip_path.exists()
-                else (
-                    f"excel_path: {excel_path} not found"
-                    if not excel_path.exists()
-                    else "both zip_path and excel_path are not found"
+    dicts = load_dicts(key)
+    # finish the moves of a batch a crash interrupted during post processing
+    mover.reconcile(basedir)
+
+    # Batches run as a pipeline: while one batch waits for its zip or excel
+    # import to finish on the server, the next ones are already uploading.
+    # The semaphore wakes waiters in order, so batches start in order.
+    semaphore = asyncio.Semaphore(config.upload_concurrency)
+
+    async def run(i: int, zip_path: Path, excel_path: Path):
+        async with semaphore:
+            with logcontext.bind(key=key, batch=batch_index(zip_path) + 1):
+                logging.info("-" * 40)
+                logging.info(f"Processing file {i + 1}/{len(pairs)}")
+                await process_pair(
+                    key, zip_path, excel_path, client, upload_journal, dicts
                 )
-            )
-            logging.warning(f"file {i + 1}/{len(pairs)} {not_found_str}")
-            continue
-
-        # Upload and process zip file
-        zip_response = await process_zip_import(zip_path, cookies)
-        logging.info(
-            f"Zip upload {i + 1}/{len(zips)} "
-            + ("OK" if zip_response.status_code < 400 else "FAILED")
-        )
-
-        # Process excel file
-        excel_upload_id = await process_excel_import(
-            excel_path.stem, excel_path, cookies
-        )
-        logging.info(
-            f"Excel import {i + 1}/{len(zips)} "
-            + ("OK" if excel_upload_id else "FAILED")
-        )
 
-        index = int(zip_path.stem.split("_")[-1]) - 1
-        post_process(
-            key=key,
-            index=index,
-            excel_upload_id=excel_upload_id,
-        )
+    try:
+        with journal.open_journal() as upload_journal:
+            async with UploaderSession(cookies=login.load_cookies()) as client:
+                # log in now if the saved session expired, not on the first upload
+                await client.get("https://admin.digikala.com")
+                results = await asyncio.gather(
+                    *(run(i, *pair) for i, pair in enumerate(pairs)),
+                    return_exceptions=True,
+                )
+    finally:
+        # poller, rate limit, retry and upload metrics of the whole run
+        metrics.log_metrics()
+
+    errors = [r for r in results if isinstance(r, BaseException)]
+    for (zip_path, _), result in zip(pairs, results, strict=True):
+        if isinstance(result, BaseException):
+            logging.error(f"Failed to upload {zip_path.name}: {result!r}")
+    if errors:
+        # keep the key dir so the failed batches can be uploaded again
+        raise errors[0]
 
     shutil.rmtree(basedir)
 
@@ -621,7 +659,8 @@ async def upload_key_dir(key: str):
 if __name__ == "__main__":
     config.config_logger()
     # main(sys.argv[1])
-    logging.info(f"Connection status: {'OK' if check_connection() < 400 else 'FAILED'}")
+    status = asyncio.run(check_connection())
+    logging.info(f"Connection status: {'OK' if status < 400 else 'FAILED'}")
     key = next(
         filter(
             lambda x: x.is_dir()